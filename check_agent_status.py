@@ -4,99 +4,408 @@ Helper script to check if the BlueZ agent is properly registered.
 Run this to verify the automatic connection setup is working.
 """
 
+import argparse
+import functools
 import dbus
 import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from dbus.mainloop.glib import DBusGMainLoop
 
-def check_agent_status():
-    """Check if an agent is registered with BlueZ."""
+
+BLUEZ_OBJECT_PATH = "/org/bluez"
+ADAPTER_INTERFACE = "org.bluez.Adapter1"
+AGENT_PATH = "/nxbt/agent"
+# NXBT owns this bus name while its agent is registered
+AGENT_BUS_NAME = "org.nxbt.Agent"
+
+# Adapter properties shown in the report, with their fallback values
+_ADAPTER_KEYS = (
+    ("Address", "Unknown"),
+    ("Name", "Unknown"),
+    ("Powered", False),
+    ("Discoverable", False),
+    ("Pairable", False),
+)
+_PROP_FMT = "  {k}: {v}".format
+
+# Seconds for which an agent probe result is reused
+_PROBE_TTL = 2
+
+_BUS = None
+
+
+def _bus():
+    """Gets the system bus connection shared by all checks."""
+    global _BUS
+    if _BUS is None:
+        _BUS = dbus.SystemBus()
+    return _BUS
+
+
+def _call(bus, path, interface, method, signature="", args=()):
+    """Calls a BlueZ method directly on the bus connection. This skips
+    the proxy object and interface wrappers (and the introspection they
+    trigger) that dbus-python builds for bus.get_object().
+    """
+    return bus.call_blocking(
+        "org.bluez", path, interface, method, signature, args)
+
+
+def _child_nodes(bus, path):
+    """Lists the names of the child nodes of a BlueZ object path."""
+    xml = _call(bus, path, "org.freedesktop.DBus.Introspectable", "Introspect")
+    root = ET.fromstring(str(xml))
+    return [node.get("name") for node in root.findall("node")]
+
+
+def _get_adapter_properties(bus, path):
+    """Reads all Adapter1 properties of an adapter in one round trip."""
+    return dict(_call(
+        bus, path, "org.freedesktop.DBus.Properties", "GetAll",
+        "s", (ADAPTER_INTERFACE,)))
+
+
+def _agent_registered(bus):
+    """Checks whether NXBT advertises its agent as registered.
+
+    The agent object is exported on NXBT's own bus connection, so it
+    can't be found by introspecting org.bluez, and BlueZ doesn't list
+    the agents registered with it. Instead NXBT owns AGENT_BUS_NAME
+    while its agent is registered. An unowned name doesn't prove the
+    agent is missing, as the bus policy may not let NXBT own it.
+
+    :return: True if the agent is registered, or None if that's unknown
+    :rtype: bool or None
+    """
+    if bus.name_has_owner(AGENT_BUS_NAME):
+        return True
+    return None
+
+
+def wait_for_agent(out=print, timeout=None):
+    """Blocks until the NXBT agent is registered with BlueZ.
+
+    Instead of re-probing in a loop, this watches the bus daemon's
+    NameOwnerChanged signal and only wakes up when NXBT claims
+    AGENT_BUS_NAME, which it does once its agent is registered. A DBus
+    main loop must be set as default before the shared bus is created.
+
+    :param out: Called with each line of the report, defaults to print
+    :param timeout: The number of seconds to wait before giving up,
+    defaults to None (no timeout)
+    :return: Whether the agent registered before the timeout
+    :rtype: bool
+    """
+    # Importing GObject introspection is slow, so only the --wait
+    # path pays for it
+    from gi.repository import GLib
+
+    bus = _bus()
+    loop = GLib.MainLoop()
+    registered = False
+
+    def on_name_owner_changed(name, old_owner, new_owner):
+        nonlocal registered
+        if new_owner:
+            registered = True
+            loop.quit()
+
+    def on_timeout():
+        loop.quit()
+        return False
+
+    match = bus.add_signal_receiver(
+        on_name_owner_changed,
+        dbus_interface="org.freedesktop.DBus",
+        signal_name="NameOwnerChanged",
+        bus_name="org.freedesktop.DBus",
+        arg0=AGENT_BUS_NAME)
     try:
-        bus = dbus.SystemBus()
-        
-        # Try to get the agent manager
-        agent_manager = dbus.Interface(
-            bus.get_object("org.bluez", "/org/bluez"),
-            "org.bluez.AgentManager1")
-        
-        print("✓ BlueZ Agent Manager is accessible")
-        
-        # Check if our agent path exists
-        try:
-            agent_obj = bus.get_object("org.bluez", "/nxbt/agent")
-            print("✓ NXBT agent is registered at /nxbt/agent")
+        # The agent may have been registered before we subscribed
+        if bus.name_has_owner(AGENT_BUS_NAME):
             return True
-        except dbus.exceptions.DBusException:
-            print("✗ NXBT agent is not currently registered")
-            print("  (This is normal if NXBT is not running)")
+        out("Waiting for the NXBT agent to register...")
+        if timeout is not None:
+            GLib.timeout_add(int(timeout * 1000), on_timeout)
+        loop.run()
+    finally:
+        match.remove()
+
+    return registered
+
+
+def _ttl_bucket():
+    """Gets a coarse timestamp that changes every _PROBE_TTL seconds."""
+    return int(time.monotonic() / _PROBE_TTL)
+
+
+@functools.lru_cache(maxsize=1)
+def _probe_agent(ttl_bucket):
+    """Probes BlueZ and the NXBT agent. Results are memoized per
+    ttl_bucket so repeated checks within the TTL skip the DBus traffic.
+
+    :return: Whether BlueZ is running, and whether the agent is
+    registered (see _agent_registered)
+    :rtype: tuple
+    """
+    bus = _bus()
+
+    # Ask the bus daemon first; this is a single cheap call and
+    # avoids any proxy setup when BlueZ isn't running at all
+    if not bus.name_has_owner("org.bluez"):
+        return False, None
+
+    # Make sure BlueZ itself answers; a failure surfaces as a
+    # DBusException for the caller to report
+    _call(bus, "/", "org.freedesktop.DBus.Peer", "Ping")
+
+    return True, _agent_registered(bus)
+
+
+def check_agent_status(out=print, state=None):
+    """Check if an agent is registered with BlueZ.
+
+    :param out: Called with each line of the report, defaults to print
+    :param state: A gather_bluez_state() result to report on, gathered
+    on demand if not given
+    :return: Whether the agent is registered, or None if that's unknown
+    """
+    try:
+        if state is None:
+            state = gather_bluez_state()
+        if state["agent_error"] is not None:
+            raise state["agent_error"]
+        if not state["bluez_running"]:
+            out("✗ BlueZ is not running")
+            out("  Make sure BlueZ is running: sudo systemctl status bluetooth")
             return False
-            
+
+        out("✓ BlueZ is responding")
+
+        if state["agent_registered"]:
+            out(f"✓ NXBT agent is registered at {AGENT_PATH}")
+            return True
+        else:
+            out(f"? NXBT agent registration is unknown ({AGENT_BUS_NAME} is unowned)")
+            out("  (NXBT is not running, or the bus policy doesn't let it own the name)")
+            return None
+
     except dbus.exceptions.DBusException as e:
-        print(f"✗ Error accessing BlueZ: {e}")
-        print("  Make sure BlueZ is running: sudo systemctl status bluetooth")
+        out(f"✗ Error accessing BlueZ: {e}")
+        out("  Make sure BlueZ is running: sudo systemctl status bluetooth")
         return False
     except Exception as e:
-        print(f"✗ Unexpected error: {e}")
+        out(f"✗ Unexpected error: {e}")
         return False
 
-def check_adapter_status():
-    """Check Bluetooth adapter status."""
+
+class AdapterCache():
+    """Keeps an in-process mirror of the BlueZ Adapter1 objects.
+
+    The cache is seeded by introspecting /org/bluez for its hciN children
+    and reading each adapter's properties, and is then kept fresh from
+    the ObjectManager InterfacesAdded/InterfacesRemoved signals and the
+    adapter PropertiesChanged signal, so repeated status checks don't
+    have to walk the whole BlueZ object tree again.
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.adapters = {}
+
+        try:
+            self._seed_from_introspection()
+        except dbus.exceptions.DBusException:
+            self._seed_from_object_manager()
+
+        self.bus.add_signal_receiver(
+            self._on_interfaces_added,
+            dbus_interface="org.freedesktop.DBus.ObjectManager",
+            signal_name="InterfacesAdded",
+            bus_name="org.bluez")
+        self.bus.add_signal_receiver(
+            self._on_interfaces_removed,
+            dbus_interface="org.freedesktop.DBus.ObjectManager",
+            signal_name="InterfacesRemoved",
+            bus_name="org.bluez")
+        self.bus.add_signal_receiver(
+            self._on_properties_changed,
+            dbus_interface="org.freedesktop.DBus.Properties",
+            signal_name="PropertiesChanged",
+            bus_name="org.bluez",
+            arg0=ADAPTER_INTERFACE,
+            path_keyword="path")
+
+    def _seed_from_introspection(self):
+        # Adapters live at /org/bluez/hciN, so only their properties
+        # need to cross the bus rather than the whole object tree
+        for name in _child_nodes(self.bus, BLUEZ_OBJECT_PATH):
+            if not name.startswith("hci"):
+                continue
+            path = f"{BLUEZ_OBJECT_PATH}/{name}"
+            self.adapters[path] = _get_adapter_properties(self.bus, path)
+
+    def _seed_from_object_manager(self):
+        # Fallback for when BlueZ can't be introspected. The whole tree
+        # still has to be unmarshalled, but only the adapter entries are
+        # kept so devices and GATT objects are freed right away.
+        objects = _call(
+            self.bus, "/", "org.freedesktop.DBus.ObjectManager",
+            "GetManagedObjects")
+        self.adapters = {
+            str(path): dict(interfaces[ADAPTER_INTERFACE])
+            for path, interfaces in objects.items()
+            if ADAPTER_INTERFACE in interfaces}
+
+    def _on_interfaces_added(self, path, interfaces):
+        if ADAPTER_INTERFACE in interfaces:
+            self.adapters[str(path)] = dict(interfaces[ADAPTER_INTERFACE])
+
+    def _on_interfaces_removed(self, path, interfaces):
+        if ADAPTER_INTERFACE in interfaces:
+            self.adapters.pop(str(path), None)
+
+    def _on_properties_changed(self, interface, changed, invalidated, path=None):
+        adapter = self.adapters.get(str(path))
+        if adapter is None:
+            return
+        adapter.update(changed)
+        if invalidated:
+            # Re-read everything at once rather than one Get per property
+            self.adapters[str(path)] = _get_adapter_properties(
+                self.bus, str(path))
+
+
+_adapter_cache = None
+
+
+def get_adapter_cache():
+    """Gets the shared AdapterCache, creating it on first use."""
+    global _adapter_cache
+    if _adapter_cache is None:
+        _adapter_cache = AdapterCache(_bus())
+    return _adapter_cache
+
+
+def gather_bluez_state():
+    """Collects what both status reports need from BlueZ in a single
+    pass, so the adapter and agent checks don't each query it. The agent
+    probe and the adapter lookup are independent and run side by side.
+
+    :return: A dict holding "adapters" (adapter path to properties),
+    "bluez_running", "agent_registered" (True, or None if unknown)
+    and "adapter_error"/"agent_error" with any exception either raised
+    :rtype: dict
+    """
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        agent_probe = pool.submit(_probe_agent, _ttl_bucket())
+        adapter_lookup = pool.submit(get_adapter_cache)
+
+        state = {
+            "adapters": {},
+            "bluez_running": False,
+            "agent_registered": None,
+            "adapter_error": adapter_lookup.exception(),
+            "agent_error": agent_probe.exception(),
+        }
+        if state["adapter_error"] is None:
+            state["adapters"] = adapter_lookup.result().adapters
+        if state["agent_error"] is None:
+            state["bluez_running"], state["agent_registered"] = (
+                agent_probe.result())
+
+    return state
+
+
+def check_adapter_status(out=print, state=None):
+    """Check Bluetooth adapter status.
+
+    :param out: Called with each line of the report, defaults to print
+    :param state: A gather_bluez_state() result to report on, gathered
+    on demand if not given
+    """
     try:
-        bus = dbus.SystemBus()
-        
-        # Get the default adapter
-        manager = dbus.Interface(
-            bus.get_object("org.bluez", "/"),
-            "org.freedesktop.DBus.ObjectManager")
-        
-        objects = manager.GetManagedObjects()
-        
-        adapter_found = False
-        for path, interfaces in objects.items():
-            if "org.bluez.Adapter1" in interfaces:
-                adapter_found = True
-                adapter = interfaces["org.bluez.Adapter1"]
-                
-                print(f"\n✓ Bluetooth Adapter found: {path}")
-                print(f"  Address: {adapter.get('Address', 'Unknown')}")
-                print(f"  Name: {adapter.get('Name', 'Unknown')}")
-                print(f"  Powered: {adapter.get('Powered', False)}")
-                print(f"  Discoverable: {adapter.get('Discoverable', False)}")
-                print(f"  Pairable: {adapter.get('Pairable', False)}")
-                break
-        
-        if not adapter_found:
-            print("✗ No Bluetooth adapter found")
+        if state is None:
+            state = gather_bluez_state()
+        if state["adapter_error"] is not None:
+            raise state["adapter_error"]
+
+        # Only the first adapter is reported, so stop at the first entry
+        try:
+            path, adapter = next(iter(state["adapters"].items()))
+        except StopIteration:
+            out("✗ No Bluetooth adapter found")
             return False
-            
+
+        out(f"\n✓ Bluetooth Adapter found: {path}")
+        for key, default in _ADAPTER_KEYS:
+            out(_PROP_FMT(k=key, v=adapter.get(key, default)))
+
         return True
-        
+
     except Exception as e:
-        print(f"✗ Error checking adapter: {e}")
+        out(f"✗ Error checking adapter: {e}")
         return False
 
 if __name__ == "__main__":
-    print("=" * 60)
-    print("NXBT Automatic Connection Status Check")
-    print("=" * 60)
-    
-    print("\n[1] Checking Bluetooth Adapter...")
-    adapter_ok = check_adapter_status()
-    
-    print("\n[2] Checking BlueZ Agent...")
-    agent_ok = check_agent_status()
-    
-    print("\n" + "=" * 60)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--wait", action="store_true",
+        help="Wait for the NXBT agent to register before checking")
+    parser.add_argument(
+        "--timeout", type=float, default=60, metavar="SECONDS",
+        help="How long --wait waits for the agent (default: 60)")
+    args = parser.parse_args()
+
+    # Signal receivers used by the adapter cache need a main loop
+    DBusGMainLoop(set_as_default=True)
+
+    if args.wait:
+        try:
+            registered = wait_for_agent(timeout=args.timeout)
+        except KeyboardInterrupt:
+            sys.exit(1)
+        if not registered:
+            print(f"✗ The NXBT agent didn't register within {args.timeout:g}s")
+            sys.exit(1)
+
+    # Query BlueZ once and let both reports read from the result
+    state = gather_bluez_state()
+    adapter_report = []
+    agent_report = []
+    adapter_ok = check_adapter_status(adapter_report.append, state)
+    agent_ok = check_agent_status(agent_report.append, state)
+
+    # The whole report is emitted with a single write
+    lines = [
+        "=" * 60,
+        "NXBT Automatic Connection Status Check",
+        "=" * 60,
+        "\n[1] Checking Bluetooth Adapter...",
+        *adapter_report,
+        "\n[2] Checking BlueZ Agent...",
+        *agent_report,
+        "\n" + "=" * 60,
+    ]
     if adapter_ok:
-        print("Status: Ready for automatic connections!")
-        print("\nTo test:")
-        print("  1. Run: sudo python3 test_auto_connect.py")
-        print("  2. Go to Switch 'Change Grip/Order' menu")
-        print("  3. Controller should connect automatically")
+        lines += [
+            "Status: Ready for automatic connections!",
+            "\nTo test:",
+            "  1. Run: sudo python3 test_auto_connect.py",
+            "  2. Go to Switch 'Change Grip/Order' menu",
+            "  3. Controller should connect automatically",
+        ]
     else:
-        print("Status: Setup incomplete")
-        print("\nPlease ensure:")
-        print("  - Bluetooth service is running")
-        print("  - You have a Bluetooth adapter")
-        print("  - You're running as root (sudo)")
-    print("=" * 60)
-    
+        lines += [
+            "Status: Setup incomplete",
+            "\nPlease ensure:",
+            "  - Bluetooth service is running",
+            "  - You have a Bluetooth adapter",
+            "  - You're running as root (sudo)",
+        ]
+    lines.append("=" * 60)
+    sys.stdout.write("\n".join(lines) + "\n")
+
     sys.exit(0 if adapter_ok else 1)
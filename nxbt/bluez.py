@@ -1,16 +1,26 @@
 import subprocess
 import re
+import shlex
 import os
 import time
 import logging
 from shutil import which
-import random
 from pathlib import Path
 import json
+import copy
+import weakref
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import socket
+import struct
+import select
+import fcntl
+import errno
 
 import dbus
 import dbus.service
 from dbus.mainloop.glib import DBusGMainLoop
+from gi.repository import GLib
 
 
 # Path for storing connection state (MAC addresses, etc.)
@@ -25,9 +35,110 @@ PROFILEMANAGER_INTERFACE = SERVICE_NAME + ".ProfileManager1"
 DEVICE_INTERFACE = SERVICE_NAME + ".Device1"
 AGENT_INTERFACE = SERVICE_NAME + ".Agent1"
 AGENTMANAGER_INTERFACE = SERVICE_NAME + ".AgentManager1"
+# Owned by NXBT while its agent is registered, so that other
+# processes can tell whether the agent is up
+AGENT_BUS_NAME = "org.nxbt.Agent"
 
 
-def find_object_path(bus, service_name, interface_name, object_name=None):
+# How long a GetManagedObjects result is reused for, in seconds
+_MANAGED_OBJECTS_TTL = 1.0
+
+# Cached GetManagedObjects results, memoized per bus connection
+_managed_objects_cache = weakref.WeakKeyDictionary()
+
+
+# The process-wide system bus connection and the PID it was opened in
+_SHARED_BUS = None
+_SHARED_BUS_PID = None
+
+
+def _shared_bus():
+    """Gets a system bus connection shared by everything in this
+    process, opening it on first use. Connections aren't inherited
+    across forks, so a forked process opens its own. The shared bus
+    should only be closed when the process is shutting down.
+
+    :return: The shared system bus connection
+    :rtype: dbus.Bus
+    """
+
+    global _SHARED_BUS, _SHARED_BUS_PID
+    if _SHARED_BUS is None or _SHARED_BUS_PID != os.getpid():
+        # A private connection keeps dbus-python from handing a forked
+        # process its parent's cached connection. The GLib main loop is
+        # attached explicitly so signals work whoever opens it first.
+        _SHARED_BUS = dbus.SystemBus(private=True, mainloop=DBusGMainLoop())
+        _SHARED_BUS_PID = os.getpid()
+    return _SHARED_BUS
+
+
+def _get_managed_objects(bus, service_name, bluez=None):
+    """Gets all objects managed by a D-Bus service, along with their
+    interfaces and properties. If a BlueZ object is given, BlueZ
+    objects are served from its signal-driven mirror without any
+    D-Bus calls. Otherwise, the result is cached on the bus for
+    _MANAGED_OBJECTS_TTL seconds so that lookups issued as part of
+    the same operation share a single GetManagedObjects call.
+
+    :param bus: A DBus object used to access the DBus.
+    :type bus: DBus
+    :param service_name: The name of a D-Bus service to get the
+    managed objects of.
+    :type service_name: string
+    :param bluez: A BlueZ object whose object mirror should be used,
+    defaults to None
+    :type bluez: BlueZ, optional
+    :return: A dictionary of object paths to a dictionary of
+    interfaces to properties
+    :rtype: dict
+    """
+
+    if bluez is not None and service_name == SERVICE_NAME:
+        return bluez.get_managed_objects()
+
+    now = time.monotonic()
+    service_cache = _managed_objects_cache.setdefault(bus, {})
+    cached = service_cache.get(service_name)
+    if cached is not None and now - cached[0] < _MANAGED_OBJECTS_TTL:
+        return cached[1]
+
+    manager = dbus.Interface(
+        bus.get_object(service_name, "/"),
+        "org.freedesktop.DBus.ObjectManager")
+    objects = manager.GetManagedObjects()
+    service_cache[service_name] = (now, objects)
+
+    return objects
+
+
+def _invalidate_managed_objects(bus):
+    """Drops any cached GetManagedObjects results for a bus. This
+    should be called after an action that adds or removes objects.
+
+    :param bus: A DBus object used to access the DBus.
+    :type bus: DBus
+    """
+
+    _managed_objects_cache.pop(bus, None)
+
+
+def _object_path_prefix(service_name):
+    """Gets the object path prefix that all of a service's objects
+    of interest live under. For BlueZ, this skips the objects other
+    than adapters and devices that share its object tree.
+
+    :param service_name: The name of a D-Bus service
+    :type service_name: string
+    :return: The object path prefix
+    :rtype: string
+    """
+    if service_name == SERVICE_NAME:
+        return BLUEZ_OBJECT_PATH + "/"
+    return "/"
+
+
+def find_object_path(bus, service_name, interface_name, object_name=None,
+                     bluez=None):
     """Searches for a D-Bus object path that contains a specified interface
     under a specified service.
 
@@ -42,18 +153,21 @@ def find_object_path(bus, service_name, interface_name, object_name=None):
     :param object_name: The name or ending of the object path,
     defaults to None
     :type object_name: string, optional
+    :param bluez: A BlueZ object whose object mirror should be
+    searched, defaults to None
+    :type bluez: BlueZ, optional
     :return: The D-Bus object path or None, if no matching object
     can be found
     :rtype: string
     """
 
-    manager = dbus.Interface(
-        bus.get_object(service_name, "/"),
-        "org.freedesktop.DBus.ObjectManager")
-
     # Iterating over objects under the specified service
     # and searching for the specified interface
-    for path, ifaces in manager.GetManagedObjects().items():
+    objects = _get_managed_objects(bus, service_name, bluez=bluez)
+    prefix = _object_path_prefix(service_name)
+    for path, ifaces in objects.items():
+        if not path.startswith(prefix):
+            continue
         managed_interface = ifaces.get(interface_name)
         if managed_interface is None:
             continue
@@ -62,13 +176,12 @@ def find_object_path(bus, service_name, interface_name, object_name=None):
         elif (not object_name or
                 object_name == managed_interface["Address"] or
                 path.endswith(object_name)):
-            obj = bus.get_object(service_name, path)
-            return dbus.Interface(obj, interface_name).object_path
+            return str(path)
 
     return None
 
 
-def find_objects(bus, service_name, interface_name):
+def find_objects(bus, service_name, interface_name, bluez=None):
     """Searches for D-Bus objects that contain a specified interface
     under a specified service.
 
@@ -80,35 +193,38 @@ def find_objects(bus, service_name, interface_name):
     :param interface_name: The name of a D-Bus interface to search for
     within objects under the specified service.
     :type interface_name: string
+    :param bluez: A BlueZ object whose object mirror should be
+    searched, defaults to None
+    :type bluez: BlueZ, optional
     :return: The D-Bus object paths matching the arguments
     :rtype: array
     """
 
-    manager = dbus.Interface(
-        bus.get_object(service_name, "/"),
-        "org.freedesktop.DBus.ObjectManager")
     paths = []
 
     # Iterating over objects under the specified service
     # and searching for the specified interface within them
-    for path, ifaces in manager.GetManagedObjects().items():
-        managed_interface = ifaces.get(interface_name)
-        if managed_interface is None:
+    objects = _get_managed_objects(bus, service_name, bluez=bluez)
+    prefix = _object_path_prefix(service_name)
+    for path, ifaces in objects.items():
+        if not path.startswith(prefix):
             continue
-        else:
-            obj = bus.get_object(service_name, path)
-            path = str(dbus.Interface(obj, interface_name).object_path)
-            paths.append(path)
+        if interface_name in ifaces:
+            paths.append(str(path))
 
     return paths
 
 
+# Matches the ExecStart line of a systemd unit file
+_EXEC_START_RE = re.compile(rb'^ExecStart=.*$', re.M)
+
+
 def toggle_clean_bluez(toggle):
     """Enables or disables all BlueZ plugins,
     BlueZ compatibility mode, and removes all extraneous
     SDP Services offered.
     Requires root user to be run. The units and Bluetooth
-    service will not be restarted if the input plugin
+    service will not be restarted if the override file
     already matches the toggle.
 
     :param toggle: A boolean element indicating if BlueZ 
@@ -124,20 +240,18 @@ def toggle_clean_bluez(toggle):
     override_path = override_dir / "nxbt.conf"
 
     if toggle:
-        if override_path.is_file():
-            # Override exist, no need to restart bluetooth
-            return
-
-        with open(service_path) as f:
-            for line in f:
-                if line.startswith("ExecStart="):
-                    exec_start = line.strip() + " --compat --noplugin=*"
-                    break
-            else:
-                raise Exception("systemd service file doesn't have a ExecStart line")
+        with open(service_path, "rb") as f:
+            match = _EXEC_START_RE.search(f.read())
+        if match is None:
+            raise Exception("systemd service file doesn't have a ExecStart line")
+        exec_start = match.group(0).decode().strip() + " --compat --noplugin=*"
 
         override = f"[Service]\nExecStart=\n{exec_start}"
 
+        if override_path.is_file() and override_path.read_text() == override:
+            # Override is already in place, no need to restart bluetooth
+            return
+
         override_dir.mkdir(parents=True, exist_ok=True)
         with override_path.open("w") as f:
             f.write(override)
@@ -154,8 +268,105 @@ def toggle_clean_bluez(toggle):
     # Reload the bluetooth service with input disabled
     _run_command(["systemctl", "restart", "bluetooth"])
 
-    # Kill a bit of time here to ensure all services have restarted
-    time.sleep(0.5)
+    # Wait for the service to come back up before continuing
+    _wait_for_bluetooth()
+
+
+def _wait_for_bluetooth(timeout=5.0):
+    """Polls the bluetooth service with an exponential backoff until
+    it reports as active, or the timeout elapses.
+
+    :param timeout: The maximum time to wait in seconds,
+    defaults to 5.0
+    :type timeout: float, optional
+    :return: True if the service became active, False otherwise
+    :rtype: bool
+    """
+
+    delay = 0.01
+    deadline = time.monotonic() + timeout
+    while True:
+        result = subprocess.run(
+            ["systemctl", "is-active", "--quiet", "bluetooth"])
+        if result.returncode == 0:
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.5)
+
+
+def _restart_bluetooth_unit(bus, timeout=10.0):
+    """Restarts the bluetooth service through systemd's D-Bus API and
+    waits for the restart job to finish. As the service is D-Bus
+    activated, BlueZ owns its bus name again once the job is done.
+
+    :param bus: A DBus object used to access the DBus.
+    :type bus: DBus
+    :param timeout: The maximum time to wait in seconds,
+    defaults to 10.0
+    :type timeout: float, optional
+    :raises Exception: If the restart job fails or times out
+    """
+
+    systemd = dbus.Interface(
+        bus.get_object(
+            "org.freedesktop.systemd1",
+            "/org/freedesktop/systemd1",
+            introspect=False),
+        "org.freedesktop.systemd1.Manager")
+
+    # Job signals are only sent to subscribed clients
+    try:
+        systemd.Subscribe()
+    except dbus.exceptions.DBusException:
+        # Already subscribed
+        pass
+
+    loop = GLib.MainLoop()
+    job_path = None
+    results = {}
+    timeout_source = None
+
+    def on_timeout():
+        nonlocal timeout_source
+        timeout_source = None
+        loop.quit()
+        return False
+
+    def on_job_removed(job_id, job, unit, result):
+        results[str(job)] = str(result)
+        if job_path is not None and str(job) == job_path:
+            loop.quit()
+
+    # Subscribe before starting the job so its completion isn't missed
+    match = bus.add_signal_receiver(
+        on_job_removed,
+        dbus_interface="org.freedesktop.systemd1.Manager",
+        signal_name="JobRemoved",
+        bus_name="org.freedesktop.systemd1")
+    try:
+        job_path = str(systemd.RestartUnit("bluetooth.service", "replace"))
+        timeout_source = GLib.timeout_add(int(timeout * 1000), on_timeout)
+        loop.run()
+    finally:
+        match.remove()
+        if timeout_source is not None:
+            GLib.source_remove(timeout_source)
+
+    result = results.get(job_path)
+    if result is None:
+        raise Exception("Timed out restarting the bluetooth service")
+    if result != "done":
+        raise Exception(f"Failed to restart the bluetooth service: {result}")
+
+
+# Matches the handle in a "Service RecHandle: 0x10000" line
+_SDP_HANDLE_RE = re.compile(r'^\s*Service RecHandle:\s*(\S+)', re.M)
+
+# SDP records that are left in place when cleaning
+_SDP_RECORD_EXCEPTIONS = ("PnP Information",)
 
 
 def clean_sdp_records():
@@ -168,10 +379,7 @@ def clean_sdp_records():
     # UnregisterProfile interface.
 
     # Check if sdptool is available for use
-    if which("sdptool") is None:
-        raise Exception("sdptool is not available on this system." +
-                        "If you can, please install this tool, as " +
-                        "it is required for proper functionality.")
+    _require_tool("sdptool")
 
     # Enable Read/Write to the SDP server. This is a remedy for a 
     # compatibility mode bug introduced in later versions of BlueZ 5
@@ -179,31 +387,41 @@ def clean_sdp_records():
 
     # Identify/List all SDP services available with sdptool
     result = _run_command(['sdptool', 'browse', 'local']).stdout.decode('utf-8')
-    if result is None or len(result.split('\n\n')) < 1:
+    if not result:
         return
+    records = result.split('\n\n')
+
+    # Record all service record handles, skipping excepted records
+    service_rec_handles = [
+        match.group(1)
+        for rec in records
+        if not any(exception in rec for exception in _SDP_RECORD_EXCEPTIONS)
+        for match in _SDP_HANDLE_RE.finditer(rec)]
     
-    # Record all service record handles
-    exceptions = ["PnP Information"]
-    service_rec_handles = []
-    for rec in result.split('\n\n'):
-        # Skip if exception is in record
-        exception_found = False
-        for exception in exceptions:
-            if exception in rec:
-                exception_found = True
-                break
-        if exception_found:
-            continue
-
-        # Read lines and add Record Handles to the list
-        for line in rec.split('\n'):
-            if "Service RecHandle" in line:
-                service_rec_handles.append(line.split(" ")[2])
-    
-    # Delete all found service records
+    # Delete all found service records in a single shell process
     if len(service_rec_handles) > 0:
-        for record_handle in service_rec_handles:
-            _run_command(['sdptool', 'del', record_handle])
+        _run_command(['sh', '-c', ' && '.join(
+            "sdptool del " + shlex.quote(record_handle)
+            for record_handle in service_rec_handles)])
+
+
+@functools.lru_cache(maxsize=None)
+def _require_tool(name):
+    """Resolves the path to a required command line tool. Successful
+    lookups are memoized so PATH is only searched once per tool.
+
+    :param name: The name of the tool
+    :type name: string
+    :raises Exception: If the tool is not available
+    :return: The path to the tool
+    :rtype: string
+    """
+    path = which(name)
+    if path is None:
+        raise Exception(f"{name} is not available on this system." +
+                        "If you can, please install this tool, as " +
+                        "it is required for proper functionality.")
+    return path
 
 
 def _run_command(command):
@@ -214,30 +432,38 @@ def _run_command(command):
 
     :param command: A list of command terms
     :type command: list
-    :raises Exception: On command failure or error
+    :raises Exception: On a non-zero exit status
     """
     result = subprocess.run(
         command,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE)
 
-    cmd_err = result.stderr.decode("utf-8").replace("\n", "")
-    if cmd_err != "":
-        raise Exception(cmd_err)
-    
+    # Only decode stderr when the command actually failed, as some
+    # tools write warnings to it even on success
+    if result.returncode:
+        cmd_err = result.stderr.decode("utf-8", "replace").strip()
+        raise Exception(cmd_err or
+                        f"{command[0]} exited with status {result.returncode}")
+
     return result
 
 
 def get_random_controller_mac():
     """Generates a random Switch-compliant MAC address
     """
-    def seg():
-        random_number = random.randint(0,255)
-        hex_number = str(hex(random_number))
-        hex_number = hex_number[2:].upper()
-        return str(hex_number)
-    
-    return f"7C:BB:8A:{seg()}:{seg()}:{seg()}"
+    suffix = os.urandom(3).hex().upper()
+    return f"7C:BB:8A:{suffix[0:2]}:{suffix[2:4]}:{suffix[4:6]}"
+
+
+# In-memory copy of the connection state file and the modification
+# time it was read at, so unchanged state isn't re-parsed from disk
+_STATE_CACHE = None
+_STATE_MTIME = 0.0
+
+# Sets mirroring each cached adapter's switch_addresses list, used for
+# constant-time membership checks when recording new connections
+_STATE_SWITCH_SETS = {}
 
 
 def load_connection_state():
@@ -248,15 +474,39 @@ def load_connection_state():
     - switch_addresses: List of Switch MAC addresses we've connected to
     - adapter_original_mac: The original MAC address of the adapter
     
-    :return: A dictionary containing the connection state, or empty dict if none exists
+    :return: A copy of the connection state, or empty dict if none exists
     :rtype: dict
     """
+    global _STATE_CACHE, _STATE_MTIME, _STATE_SWITCH_SETS
     try:
-        if NXBT_STATE_FILE.exists():
-            with open(NXBT_STATE_FILE, 'r') as f:
-                return json.load(f)
+        mtime = NXBT_STATE_FILE.stat().st_mtime
+    except OSError:
+        _STATE_CACHE = None
+        _STATE_SWITCH_SETS = {}
+        return {}
+
+    # The file is unchanged since it was last read or written. A copy
+    # is returned so that callers' edits don't change the cache.
+    if _STATE_CACHE is not None and mtime == _STATE_MTIME:
+        return copy.deepcopy(_STATE_CACHE)
+
+    try:
+        with open(NXBT_STATE_FILE, 'r') as f:
+            state = json.load(f)
+        # Normalize stored Switch addresses to unique, uppercase entries
+        switch_sets = {}
+        for adapter_id, adapter_data in state.get('adapters', {}).items():
+            adapter_data['switch_addresses'] = list(dict.fromkeys(
+                map(str.upper, adapter_data.get('switch_addresses', []))))
+            switch_sets[adapter_id] = set(adapter_data['switch_addresses'])
+        _STATE_CACHE = state
+        _STATE_SWITCH_SETS = switch_sets
+        _STATE_MTIME = mtime
+        return copy.deepcopy(_STATE_CACHE)
     except (json.JSONDecodeError, IOError) as e:
         logging.getLogger('nxbt').debug(f"Failed to load connection state: {e}")
+    _STATE_CACHE = None
+    _STATE_SWITCH_SETS = {}
     return {}
 
 
@@ -266,10 +516,24 @@ def save_connection_state(state):
     :param state: A dictionary containing the connection state
     :type state: dict
     """
+    global _STATE_CACHE, _STATE_MTIME, _STATE_SWITCH_SETS
     try:
         NXBT_STATE_DIR.mkdir(parents=True, exist_ok=True)
-        with open(NXBT_STATE_FILE, 'w') as f:
+        # Write to a temporary file first so readers never see
+        # a partially written state file
+        tmp_path = NXBT_STATE_FILE.with_suffix(".tmp")
+        with open(tmp_path, 'w') as f:
             json.dump(state, f, indent=2)
+        os.replace(tmp_path, NXBT_STATE_FILE)
+        mtime = NXBT_STATE_FILE.stat().st_mtime
+        # The cache only changes once the file has, so a failed
+        # save leaves both in agreement
+        _STATE_CACHE = copy.deepcopy(state)
+        _STATE_SWITCH_SETS = {
+            adapter_id: set(adapter_data.get('switch_addresses', []))
+            for adapter_id, adapter_data
+            in _STATE_CACHE.get('adapters', {}).items()}
+        _STATE_MTIME = mtime
     except IOError as e:
         logging.getLogger('nxbt').debug(f"Failed to save connection state: {e}")
 
@@ -310,10 +574,16 @@ def update_connection_state(adapter_path, adapter_mac, switch_address, original_
     if original_mac and not state['adapters'][adapter_id].get('original_mac'):
         state['adapters'][adapter_id]['original_mac'] = original_mac
     
-    # Add the Switch address if not already in the list
-    if switch_address and switch_address.upper() not in [
-            addr.upper() for addr in state['adapters'][adapter_id]['switch_addresses']]:
-        state['adapters'][adapter_id]['switch_addresses'].append(switch_address.upper())
+    # Add the Switch address if not already in the list. Stored
+    # addresses are normalized to uppercase on load, and the cached
+    # set is only read here since saving rebuilds it.
+    if switch_address:
+        known = _STATE_SWITCH_SETS.get(adapter_id)
+        if known is None:
+            known = set(state['adapters'][adapter_id]['switch_addresses'])
+        if switch_address.upper() not in known:
+            state['adapters'][adapter_id]['switch_addresses'].append(
+                switch_address.upper())
     
     save_connection_state(state)
     logging.getLogger('nxbt').debug(
@@ -356,7 +626,8 @@ def get_stored_switch_addresses(adapter_path=None):
     if adapter_path:
         adapter_id = adapter_path.split('/')[-1]
         if adapter_id in state['adapters']:
-            addresses = state['adapters'][adapter_id].get('switch_addresses', [])
+            addresses = list(
+                state['adapters'][adapter_id].get('switch_addresses', []))
     else:
         # Get all addresses from all adapters
         for adapter_data in state['adapters'].values():
@@ -367,6 +638,226 @@ def get_stored_switch_addresses(adapter_path=None):
     return addresses
 
 
+# HCI socket options and ioctls, from the kernel's hci.h/hci_sock.h
+SOL_HCI = 0
+HCI_FILTER = 2
+HCIDEVUP = 0x400448c9
+HCIDEVDOWN = 0x400448ca
+HCIGETCONNINFO = 0x800448d5
+ACL_LINK = 0x01
+# Offset of struct hci_conn_info within an HCIGETCONNINFO request,
+# and its size
+HCI_CONN_INFO_OFFSET = 8
+HCI_CONN_INFO_SIZE = 16
+
+HCI_COMMAND_PKT = 0x01
+HCI_EVENT_PKT = 0x04
+EVT_CMD_COMPLETE = 0x0E
+EVT_CMD_STATUS = 0x0F
+
+# Vendor command for writing the adapter's Bluetooth address
+OGF_VENDOR_CMD = 0x3f
+OCF_WRITE_BD_ADDR = 0x001
+
+# Host controller commands for the adapter's class of device
+OGF_HOST_CTL = 0x03
+OCF_READ_CLASS_OF_DEV = 0x0023
+OCF_WRITE_CLASS_OF_DEV = 0x0024
+
+# Link policy command and settings for a connection
+OGF_LINK_POLICY = 0x02
+OCF_WRITE_LINK_POLICY = 0x000D
+HCI_LP_RSWITCH = 0x0001
+
+
+def _hci_device_id(adapter):
+    """Gets the numeric HCI device ID of an adapter.
+
+    :param adapter: An adapter ID or path, Eg: "hci0" or "/org/bluez/hci0"
+    :type adapter: string
+    :return: The HCI device ID, Eg: 0
+    :rtype: int
+    """
+    return int(adapter.split('/')[-1][len("hci"):])
+
+
+def _mac_to_hci_bytes(mac):
+    """Converts a MAC address into the byte-reversed form expected
+    by HCI commands, as HCI is little-endian.
+
+    :param mac: A Bluetooth MAC address in
+    the form of "XX:XX:XX:XX:XX:XX"
+    :type mac: string
+    :return: The address bytes, least significant first
+    :rtype: bytes
+    """
+    return bytes.fromhex(mac.replace(':', ''))[::-1]
+
+
+def _hci_send_command(dev_id, ogf, ocf, params=b"", timeout=2.0):
+    """Sends an HCI command to an adapter over a raw HCI socket and
+    waits for the controller to acknowledge it.
+
+    :param dev_id: The HCI device ID of the adapter
+    :type dev_id: int
+    :param ogf: The command's Opcode Group Field
+    :type ogf: int
+    :param ocf: The command's Opcode Command Field
+    :type ocf: int
+    :param params: The command's parameters, defaults to b""
+    :type params: bytes, optional
+    :param timeout: How long to wait for a reply in seconds,
+    defaults to 2.0
+    :type timeout: float, optional
+    :raises Exception: On a failed status or no reply
+    :return: The command's return parameters, following the status
+    :rtype: bytes
+    """
+
+    opcode = (ogf << 10) | ocf
+    with socket.socket(socket.AF_BLUETOOTH, socket.SOCK_RAW,
+                       socket.BTPROTO_HCI) as sock:
+        sock.bind((dev_id,))
+        # Only receive completion events for this command
+        sock.setsockopt(SOL_HCI, HCI_FILTER, struct.pack(
+            "<IIIH",
+            1 << HCI_EVENT_PKT,
+            (1 << EVT_CMD_COMPLETE) | (1 << EVT_CMD_STATUS),
+            0,
+            opcode))
+        sock.send(struct.pack("<BHB", HCI_COMMAND_PKT, opcode, len(params))
+                  + params)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                raise Exception(
+                    f"No reply to HCI command 0x{opcode:04x} on hci{dev_id}")
+            event = sock.recv(260)
+            if len(event) < 7 or event[0] != HCI_EVENT_PKT:
+                continue
+
+            # Command Complete: ncmd, opcode, status
+            # Command Status: status, ncmd, opcode
+            if event[1] == EVT_CMD_COMPLETE:
+                reply_opcode, status = struct.unpack_from("<HB", event, 4)
+                reply_params = event[7:]
+            elif event[1] == EVT_CMD_STATUS:
+                status, _, reply_opcode = struct.unpack_from("<BBH", event, 3)
+                reply_params = b""
+            else:
+                continue
+            if reply_opcode != opcode:
+                continue
+            if status != 0:
+                raise Exception(
+                    f"HCI command 0x{opcode:04x} failed on hci{dev_id} " +
+                    f"with status 0x{status:02x}")
+            return reply_params
+
+
+def _hci_reset(dev_id):
+    """Resets an adapter by bringing its HCI device down and back up,
+    as "hciconfig <adapter> reset" does.
+
+    :param dev_id: The HCI device ID of the adapter
+    :type dev_id: int
+    """
+
+    with socket.socket(socket.AF_BLUETOOTH, socket.SOCK_RAW,
+                       socket.BTPROTO_HCI) as sock:
+        fcntl.ioctl(sock.fileno(), HCIDEVDOWN, dev_id)
+        try:
+            fcntl.ioctl(sock.fileno(), HCIDEVUP, dev_id)
+        except OSError as e:
+            # The device may have been brought back up already
+            if e.errno != errno.EALREADY:
+                raise
+
+
+def _read_class_of_dev(dev_id):
+    """Reads an adapter's class of device.
+
+    :param dev_id: The HCI device ID of the adapter
+    :type dev_id: int
+    :return: The class of device as a hex string, Eg: "0x002508"
+    :rtype: string
+    """
+
+    reply = _hci_send_command(dev_id, OGF_HOST_CTL, OCF_READ_CLASS_OF_DEV)
+    return f"0x{int.from_bytes(reply[:3], 'little'):06x}"
+
+
+def _write_class_of_dev(dev_id, device_class):
+    """Writes an adapter's class of device.
+
+    :param dev_id: The HCI device ID of the adapter
+    :type dev_id: int
+    :param device_class: The class of device as a hex string,
+    Eg: "0x002508"
+    :type device_class: string
+    """
+
+    _hci_send_command(dev_id, OGF_HOST_CTL, OCF_WRITE_CLASS_OF_DEV,
+                      int(device_class, 16).to_bytes(3, 'little'))
+
+
+def _hci_connection_handle(dev_id, address):
+    """Gets the handle of an adapter's ACL connection to a device.
+
+    :param dev_id: The HCI device ID of the adapter
+    :type dev_id: int
+    :param address: The device's Bluetooth MAC address
+    :type address: string
+    :return: The connection handle
+    :rtype: int
+    """
+
+    # struct hci_conn_info_req (bdaddr, type), padded to the 4 byte
+    # alignment of the struct hci_conn_info the kernel fills in
+    # after it (handle first)
+    request = bytearray(
+        _mac_to_hci_bytes(address) + bytes([ACL_LINK]) + bytes(1) +
+        bytes(HCI_CONN_INFO_SIZE))
+    with socket.socket(socket.AF_BLUETOOTH, socket.SOCK_RAW,
+                       socket.BTPROTO_HCI) as sock:
+        sock.bind((dev_id,))
+        fcntl.ioctl(sock.fileno(), HCIGETCONNINFO, request)
+    return struct.unpack_from("<H", request, HCI_CONN_INFO_OFFSET)[0]
+
+
+def _write_link_policy(dev_id, handle, policy):
+    """Writes the link policy settings of a connection.
+
+    :param dev_id: The HCI device ID of the adapter
+    :type dev_id: int
+    :param handle: The connection handle
+    :type handle: int
+    :param policy: The HCI_LP_* flags the link may use
+    :type policy: int
+    """
+
+    _hci_send_command(dev_id, OGF_LINK_POLICY, OCF_WRITE_LINK_POLICY,
+                      struct.pack("<HH", handle, policy))
+
+
+def _write_bd_addr(dev_id, mac):
+    """Writes a Bluetooth address to an adapter and resets it so the
+    new address takes effect.
+
+    :param dev_id: The HCI device ID of the adapter
+    :type dev_id: int
+    :param mac: A Bluetooth MAC address in
+    the form of "XX:XX:XX:XX:XX:XX"
+    :type mac: string
+    """
+
+    _hci_send_command(dev_id, OGF_VENDOR_CMD, OCF_WRITE_BD_ADDR,
+                      _mac_to_hci_bytes(mac))
+    _hci_reset(dev_id)
+
+
 def replace_mac_addresses(adapter_paths, addresses):
     """Replaces a list of adapter's Bluetooth MAC addresses
     with Switch-compliant Controller MAC addresses. If the
@@ -380,29 +871,22 @@ def replace_mac_addresses(adapter_paths, addresses):
     defaults to False
     :type addresses: bool, optional
     """
-    if which("hcitool") is None:
-        raise Exception("hcitool is not available on this system." +
-                        "If you can, please install this tool, as " +
-                        "it is required for proper functionality.")
-    if which("hciconfig") is None:
-        raise Exception("hciconfig is not available on this system." +
-                        "If you can, please install this tool, as " +
-                        "it is required for proper functionality.")
-
     if addresses:
         assert len(addresses) == len(adapter_paths)
 
-    for i in range(len(adapter_paths)):
-        adapter_id = adapter_paths[i].split('/')[-1]
-        mac = addresses[i].split(':')
-        cmds = ['hcitool', '-i', adapter_id, 'cmd', '0x3f', '0x001',
-                f'0x{mac[5]}',f'0x{mac[4]}',f'0x{mac[3]}',f'0x{mac[2]}',
-                f'0x{mac[1]}',f'0x{mac[0]}']
-        _run_command(cmds)
-        _run_command(['hciconfig', adapter_id, 'reset'])
+    if not adapter_paths:
+        return
+
+    # Adapters are independent, so replace their addresses concurrently
+    with ThreadPoolExecutor(max_workers=len(adapter_paths)) as executor:
+        list(executor.map(
+            _write_bd_addr,
+            map(_hci_device_id, adapter_paths),
+            addresses))
 
 
-def find_devices_by_alias(alias, return_path=False, created_bus=None):
+def find_devices_by_alias(alias, return_path=False, created_bus=None,
+                          bluez=None):
     """Finds the Bluetooth addresses of devices
     that have a specified Bluetooth alias. Aliases
     are converted to uppercase before comparison
@@ -410,42 +894,35 @@ def find_devices_by_alias(alias, return_path=False, created_bus=None):
 
     :param address: The Bluetooth MAC address
     :type address: string
+    :param bluez: A BlueZ object whose bus and object mirror
+    should be used, defaults to None
+    :type bluez: BlueZ, optional
     :return: The path to the D-Bus object or None
     :rtype: string or None
     """
 
+    if bluez is not None and created_bus is None:
+        created_bus = bluez.bus
     if created_bus is not None:
         bus = created_bus
     else:
-        bus = dbus.SystemBus()
-    # Find all connected/paired/discovered devices
-    devices = find_objects(
-        bus,
-        SERVICE_NAME,
-        DEVICE_INTERFACE)
+        bus = _shared_bus()
+    # Find all connected/paired/discovered devices and read their
+    # properties straight from the managed objects
+    objects = _get_managed_objects(bus, SERVICE_NAME, bluez=bluez)
 
+    target_alias = alias.upper()
     addresses = []
     matching_paths = []
-    for path in devices:
-        # Get the device's address and paired status
-        device_props = dbus.Interface(
-            bus.get_object(SERVICE_NAME, path),
-            "org.freedesktop.DBus.Properties")
-        device_alias = device_props.Get(
-            DEVICE_INTERFACE,
-            "Alias").upper()
-        device_addr = device_props.Get(
-            DEVICE_INTERFACE,
-            "Address").upper()
-
-        # Check for an address match
-        if device_alias.upper() == alias.upper():
-            addresses.append(device_addr)
-            matching_paths.append(path)
-
-    # Close the dbus connection if we created one
-    if created_bus is None:
-        bus.close()
+    for path, ifaces in objects.items():
+        device = ifaces.get(DEVICE_INTERFACE)
+        if device is None:
+            continue
+
+        # Check for an alias match
+        if device.get("Alias", "").upper() == target_alias:
+            addresses.append(device.get("Address", "").upper())
+            matching_paths.append(str(path))
 
     if return_path:
         return addresses, matching_paths
@@ -453,47 +930,49 @@ def find_devices_by_alias(alias, return_path=False, created_bus=None):
         return addresses
 
 
-def disconnect_devices_by_alias(alias, created_bus=None):
+def disconnect_devices_by_alias(alias, created_bus=None, bluez=None):
     """Disconnects all devices matching an alias.
 
     :param alias: The device's alias
     :type alias: string
+    :param bluez: A BlueZ object whose bus and object mirror
+    should be used, defaults to None
+    :type bluez: BlueZ, optional
     """
 
+    if bluez is not None and created_bus is None:
+        created_bus = bluez.bus
     if created_bus is not None:
         bus = created_bus
     else:
-        bus = dbus.SystemBus()
-    # Find all connected/paired/discovered devices
-    devices = find_objects(
-        bus,
-        SERVICE_NAME,
-        DEVICE_INTERFACE)
-
-    addresses = []
-    matching_paths = []
-    for path in devices:
-        # Get the device's address and paired status
-        device_props = dbus.Interface(
-            bus.get_object(SERVICE_NAME, path),
-            "org.freedesktop.DBus.Properties")
-        device_alias = device_props.Get(
-            DEVICE_INTERFACE,
-            "Alias").upper()
+        bus = _shared_bus()
+    # Find all connected/paired/discovered devices and read their
+    # aliases straight from the managed objects
+    objects = _get_managed_objects(bus, SERVICE_NAME, bluez=bluez)
+
+    target_alias = alias.upper()
+    matching_paths = [
+        path for path, ifaces in objects.items()
+        if ifaces.get(DEVICE_INTERFACE, {}).get("Alias", "").upper()
+        == target_alias]
+
+    def disconnect(path):
+        # The proxy skips introspection since the interface is known
+        device = dbus.Interface(
+            bus.get_object(SERVICE_NAME, path, introspect=False),
+            DEVICE_INTERFACE)
+        try:
+            device.Disconnect()
+        except Exception as e:
+            print(e)
 
-        # Check for an alias match
-        if device_alias.upper() == alias.upper():
-            device = dbus.Interface(
-                bus.get_object(SERVICE_NAME, path),
-                DEVICE_INTERFACE)
-            try:
-                device.Disconnect()
-            except Exception as e:
-                print(e)
+    # Disconnect concurrently so a slow device doesn't hold up the rest
+    if matching_paths:
+        with ThreadPoolExecutor(max_workers=len(matching_paths)) as executor:
+            list(executor.map(disconnect, matching_paths))
 
-    # Close the dbus connection if we created one
-    if created_bus is None:
-        bus.close()
+    # Connection state changed, so drop the cached objects
+    _invalidate_managed_objects(bus)
 
 
 class AutoAcceptAgent(dbus.service.Object):
@@ -561,56 +1040,230 @@ class BlueZ():
     """Exposes the BlueZ D-Bus API as a Python object.
     """
 
-    def __init__(self, adapter_path="/org/bluez/hci0"):
+    def __init__(self, adapter_path="/org/bluez/hci0", bus=None):
 
         self.logger = logging.getLogger('nxbt')
 
         # Initialize DBus main loop for agent support
         DBusGMainLoop(set_as_default=True)
 
-        self.bus = dbus.SystemBus()
+        # Use the process-wide bus unless one is given. Either way,
+        # the bus isn't owned by this object and isn't closed by it.
+        if bus is None:
+            bus = _shared_bus()
+        self.bus = bus
         self.device_path = adapter_path
 
+        # Mirror the BlueZ object tree so lookups don't need to
+        # re-poll the ObjectManager. Signals are subscribed to before
+        # seeding so no changes are missed in between. They're matched
+        # on the well-known name so they survive a bluetoothd restart.
+        self._object_manager = self._get_proxy(
+            "/", "org.freedesktop.DBus.ObjectManager")
+        self._dev_proxies = {}
+        # Device paths keyed by uppercase address, built on first lookup
+        self._addr_index = None
+        self._signal_matches = [
+            self.bus.add_signal_receiver(
+                self._on_interfaces_added,
+                dbus_interface="org.freedesktop.DBus.ObjectManager",
+                signal_name="InterfacesAdded",
+                bus_name=SERVICE_NAME),
+            self.bus.add_signal_receiver(
+                self._on_interfaces_removed,
+                dbus_interface="org.freedesktop.DBus.ObjectManager",
+                signal_name="InterfacesRemoved",
+                bus_name=SERVICE_NAME),
+            self.bus.add_signal_receiver(
+                self._on_properties_changed,
+                dbus_interface="org.freedesktop.DBus.Properties",
+                signal_name="PropertiesChanged",
+                bus_name=SERVICE_NAME,
+                path_keyword="path"),
+        ]
+        self._seed_objects()
+
         # If we weren't able to find an adapter with the specified ID,
         # try to find any usable Bluetooth adapter
         if self.device_path is None:
             self.device_path = find_object_path(
                 self.bus,
                 SERVICE_NAME,
-                ADAPTER_INTERFACE)
+                ADAPTER_INTERFACE,
+                bluez=self)
 
         # If we aren't able to find an adapter still
         if self.device_path is None:
             raise Exception("Unable to find a bluetooth adapter")
 
-        # Load the adapter's interface
+        # Load the adapter's and ProfileManager's interfaces
         self.logger.debug(f"Using adapter under object path: {self.device_path}")
-        self.device = dbus.Interface(
-            self.bus.get_object(
-                SERVICE_NAME,
-                self.device_path),
-            "org.freedesktop.DBus.Properties")
+        self._bind_proxies()
 
         self.device_id = self.device_path.split("/")[-1]
 
-        # Load the ProfileManager interface
-        self.profile_manager = dbus.Interface(self.bus.get_object(
-            SERVICE_NAME, BLUEZ_OBJECT_PATH),
-            PROFILEMANAGER_INTERFACE)
-
-        self.adapter = dbus.Interface(
-            self.bus.get_object(
-                SERVICE_NAME,
-                self.device_path),
-            ADAPTER_INTERFACE)
-
         # Store the original MAC address for potential restoration
+        self._raw_address = None
+        self._upper_address = None
         self._original_address = self.address
         
-        # Register auto-accept agent for handling pairing/authorization
+        # The auto-accept agent for handling pairing/authorization is
+        # registered lazily, once pairing is enabled
         self.agent = None
         self.agent_path = "/nxbt/agent"
-        self._register_agent()
+
+    def _get_proxy(self, path, interface):
+        """Gets an interface on a BlueZ object. Introspection is
+        skipped, as the interfaces used are known ahead of time.
+
+        :param path: The D-Bus object path
+        :type path: string
+        :param interface: The D-Bus interface name
+        :type interface: string
+        :return: The interface proxy
+        :rtype: dbus.Interface
+        """
+
+        return dbus.Interface(
+            self.bus.get_object(SERVICE_NAME, path, introspect=False),
+            interface)
+
+    def _bind_proxies(self):
+        # Proxies are bound to bluetoothd's unique bus name, so these
+        # need rebuilding whenever the service is restarted
+        self._object_manager = self._get_proxy(
+            "/", "org.freedesktop.DBus.ObjectManager")
+        self.device = self._get_proxy(
+            self.device_path, "org.freedesktop.DBus.Properties")
+        # Bound methods for the adapter's properties, so calls skip
+        # the proxy's per-call attribute lookup
+        self._dev_set = self.device.get_dbus_method(
+            "Set", "org.freedesktop.DBus.Properties")
+        self._dev_getall = self.device.get_dbus_method(
+            "GetAll", "org.freedesktop.DBus.Properties")
+        self.adapter = self._get_proxy(self.device_path, ADAPTER_INTERFACE)
+        self.profile_manager = self._get_proxy(
+            BLUEZ_OBJECT_PATH, PROFILEMANAGER_INTERFACE)
+        self._agent_manager = self._get_proxy(
+            BLUEZ_OBJECT_PATH, AGENTMANAGER_INTERFACE)
+        # Proxies for individual devices, built on first use
+        self._dev_proxies = {}
+
+    def _get_device_proxies(self, device_path):
+        """Gets the Device1 and Properties interfaces of a device,
+        reusing them across calls for the same device.
+
+        :param device_path: The D-Bus path to the device
+        :type device_path: string
+        :return: The device's Device1 and Properties interfaces
+        :rtype: tuple
+        """
+
+        device_path = str(device_path)
+        proxies = self._dev_proxies.get(device_path)
+        if proxies is None:
+            proxies = (
+                self._get_proxy(device_path, DEVICE_INTERFACE),
+                self._get_proxy(
+                    device_path, "org.freedesktop.DBus.Properties"))
+            self._dev_proxies[device_path] = proxies
+        return proxies
+
+    def _seed_objects(self):
+        self._addr_index = None
+        self._objects = {
+            str(path): {str(iface): dict(props)
+                        for iface, props in ifaces.items()}
+            for path, ifaces in self._object_manager.GetManagedObjects().items()}
+
+    def _on_interfaces_added(self, path, interfaces):
+        if DEVICE_INTERFACE in interfaces:
+            self._addr_index = None
+        obj = self._objects.setdefault(str(path), {})
+        for iface, props in interfaces.items():
+            obj[str(iface)] = dict(props)
+
+    def _on_interfaces_removed(self, path, interfaces):
+        if DEVICE_INTERFACE in interfaces:
+            self._dev_proxies.pop(str(path), None)
+            self._addr_index = None
+        obj = self._objects.get(str(path))
+        if obj is None:
+            return
+        for iface in interfaces:
+            obj.pop(str(iface), None)
+        if not obj:
+            self._objects.pop(str(path), None)
+
+    def _on_properties_changed(self, interface, changed, invalidated,
+                               path=None):
+        obj = self._objects.get(str(path))
+        if obj is None or str(interface) not in obj:
+            return
+        props = obj[str(interface)]
+        props.update(changed)
+        for prop in invalidated:
+            props.pop(prop, None)
+
+    def _get_all_devices_cached(self):
+        """Gets the properties of every device BlueZ knows about from
+        the mirrored object tree, without any D-Bus calls.
+
+        :return: A dictionary of device object paths to properties
+        :rtype: dict
+        """
+
+        return {
+            path: ifaces[DEVICE_INTERFACE]
+            for path, ifaces in self.get_managed_objects().items()
+            if DEVICE_INTERFACE in ifaces}
+
+    def get_managed_objects(self):
+        """Gets the mirrored BlueZ object tree. Any queued D-Bus
+        signals are dispatched first so the mirror is current even
+        if no main loop is running.
+
+        :return: A dictionary of object paths to a dictionary of
+        interfaces to properties
+        :rtype: dict
+        """
+
+        context = GLib.MainContext.default()
+        while context.pending():
+            context.iteration(False)
+
+        return self._objects
+
+    def _get_all_adapter_props(self, required=()):
+        """Gets all of the adapter's properties from the mirrored object
+        tree, which is kept current by PropertiesChanged signals. If the
+        adapter isn't mirrored or is missing a required property, all
+        properties are re-read with a single GetAll call.
+
+        :param required: Names of properties that must be present,
+        defaults to ()
+        :type required: iterable, optional
+        :return: A dictionary of the adapter's properties
+        :rtype: dict
+        """
+
+        props = self.get_managed_objects().get(
+            self.device_path, {}).get(ADAPTER_INTERFACE)
+        if props is None or any(name not in props for name in required):
+            props = dict(self._dev_getall(ADAPTER_INTERFACE))
+            self._on_interfaces_added(
+                self.device_path, {ADAPTER_INTERFACE: props})
+        return props
+
+    def _adapter_property(self, name):
+        """Gets a property of the adapter. See _get_all_adapter_props.
+
+        :param name: The name of the adapter property
+        :type name: string
+        :return: The property's value
+        """
+
+        return self._get_all_adapter_props((name,))[name]
 
     @property
     def original_address(self):
@@ -629,31 +1282,25 @@ class BlueZ():
         :rtype: string
         """
 
-        return self.device.Get(ADAPTER_INTERFACE, "Address").upper()
+        address = self._adapter_property("Address")
+        if address != self._raw_address:
+            self._raw_address = address
+            self._upper_address = address.upper()
+        return self._upper_address
 
     def set_address(self, mac):
         """Sets the Bluetooth MAC address of the Bluetooth adapter.
-        The hciconfig CLI is required for setting the address.
-        For changes to apply, the Bluetooth interface needs to be
-        restarted.
+        The address is written with a vendor HCI command over a raw
+        HCI socket, and the adapter is then reset for the change
+        to apply.
 
         :param mac: A Bluetooth MAC address in 
         the form of "XX:XX:XX:XX:XX:XX
         :type mac: str
         :raises PermissionError: On run as non-root user
-        :raises Exception: On CLI errors
+        :raises Exception: On HCI errors
         """
-        if which("hcitool") is None:
-            raise Exception("hcitool is not available on this system." +
-                            "If you can, please install this tool, as " +
-                            "it is required for proper functionality.")
-        # Reverse MAC (element position-wise) for use with hcitool
-        mac_parts = mac.split(":")
-        cmds = ['hcitool', '-i', self.device_id, 'cmd', '0x3f', '0x001',
-                f'0x{mac_parts[5]}',f'0x{mac_parts[4]}',f'0x{mac_parts[3]}',f'0x{mac_parts[2]}',
-                f'0x{mac_parts[1]}',f'0x{mac_parts[0]}']
-        _run_command(cmds)
-        _run_command(['hciconfig', self.device_id, 'reset'])
+        _write_bd_addr(_hci_device_id(self.device_id), mac)
         self.logger.debug(f"Set adapter MAC address to {mac}")
 
     def prepare_for_reconnect(self, switch_address=None):
@@ -707,18 +1354,24 @@ class BlueZ():
         self.logger.debug(f"Saved connection info: adapter={self.address}, switch={switch_address}")
 
     def set_class(self, device_class):
-        if which("hciconfig") is None:
-            raise Exception("hciconfig is not available on this system." +
-                            "If you can, please install this tool, as " +
-                            "it is required for proper functionality.")
-        _run_command(['hciconfig', self.device_id, 'class', device_class])
+        _write_class_of_dev(_hci_device_id(self.device_id), device_class)
 
     def reset_adapter(self):
-        if which("hciconfig") is None:
-            raise Exception("hciconfig is not available on this system." +
-                            "If you can, please install this tool, as " +
-                            "it is required for proper functionality.")
-        _run_command(['hciconfig', self.device_id, 'reset'])
+        _hci_reset(_hci_device_id(self.device_id))
+
+    def disable_sniff_mode(self, address):
+        """Keeps the connection to a device in active mode by only
+        allowing role switches in its link policy. A link in sniff,
+        hold or park mode only exchanges packets every sniff interval,
+        which adds that interval to input latency.
+
+        :param address: The connected device's Bluetooth MAC address
+        :type address: string
+        """
+
+        dev_id = _hci_device_id(self.device_id)
+        handle = _hci_connection_handle(dev_id, address)
+        _write_link_policy(dev_id, handle, HCI_LP_RSWITCH)
 
     @property
     def name(self):
@@ -728,7 +1381,7 @@ class BlueZ():
         :rtype: string
         """
 
-        return self.device.Get(ADAPTER_INTERFACE, "Name")
+        return self._adapter_property("Name")
 
     @property
     def alias(self):
@@ -740,7 +1393,7 @@ class BlueZ():
         :rtype: string
         """
 
-        return self.device.Get(ADAPTER_INTERFACE, "Alias")
+        return self._adapter_property("Alias")
 
     def set_alias(self, value):
         """Asynchronously sets the alias of the Bluetooth adapter.
@@ -751,7 +1404,7 @@ class BlueZ():
         :type value: string
         """
 
-        self.device.Set(ADAPTER_INTERFACE, "Alias", value)
+        self._dev_set(ADAPTER_INTERFACE, "Alias", value)
 
     @property
     def pairable(self):
@@ -762,7 +1415,7 @@ class BlueZ():
         :rtype: boolean
         """
 
-        return bool(self.device.Get(ADAPTER_INTERFACE, "Pairable"))
+        return bool(self._adapter_property("Pairable"))
 
     def set_pairable(self, value):
         """Sets the pariable boolean status of the Bluetooth adapter.
@@ -772,8 +1425,12 @@ class BlueZ():
         :type value: boolean
         """
 
+        # Pairing needs an agent to accept incoming requests
+        if value:
+            self.ensure_agent()
+
         dbus_value = dbus.Boolean(value)
-        self.device.Set(ADAPTER_INTERFACE, "Pairable", dbus_value)
+        self._dev_set(ADAPTER_INTERFACE, "Pairable", dbus_value)
 
     @property
     def pairable_timeout(self):
@@ -784,7 +1441,7 @@ class BlueZ():
         :rtype: int
         """
 
-        return self.device.Get(ADAPTER_INTERFACE, "PairableTimeout")
+        return self._adapter_property("PairableTimeout")
 
     def set_pairable_timeout(self, value):
         """Sets the timeout time (in seconds) for the pairable property.
@@ -794,7 +1451,27 @@ class BlueZ():
         """
 
         dbus_value = dbus.UInt32(value)
-        self.device.Set(ADAPTER_INTERFACE, "PairableTimeout", dbus_value)
+        self._dev_set(ADAPTER_INTERFACE, "PairableTimeout", dbus_value)
+
+    def get_device_props_bulk(self, device_path, names):
+        """Gets several properties of a device with a single GetAll
+        call, rather than one Get call per property. The object
+        mirror is refreshed with the result.
+
+        :param device_path: The D-Bus path to the device
+        :type device_path: string
+        :param names: The names of the properties to read
+        :type names: iterable
+        :return: A dictionary of the requested properties that
+        the device has
+        :rtype: dict
+        """
+
+        _, device_props = self._get_device_proxies(device_path)
+        props = device_props.GetAll(DEVICE_INTERFACE)
+        self._on_interfaces_added(device_path, {DEVICE_INTERFACE: props})
+
+        return {name: props[name] for name in names if name in props}
 
     def trust_device(self, device_path):
         """Marks a device as trusted to allow automatic connections.
@@ -803,9 +1480,7 @@ class BlueZ():
         :type device_path: string
         """
         try:
-            device_props = dbus.Interface(
-                self.bus.get_object(SERVICE_NAME, device_path),
-                "org.freedesktop.DBus.Properties")
+            _, device_props = self._get_device_proxies(device_path)
             device_props.Set(DEVICE_INTERFACE, "Trusted", dbus.Boolean(True))
             self.logger.debug(f"Device {device_path} marked as trusted")
         except dbus.exceptions.DBusException as e:
@@ -819,7 +1494,7 @@ class BlueZ():
         :rtype: boolean
         """
 
-        return bool(self.device.Get(ADAPTER_INTERFACE, "Discoverable"))
+        return bool(self._adapter_property("Discoverable"))
 
     def set_discoverable(self, value):
         """Sets the discoverable boolean status of the Bluetooth adapter.
@@ -830,7 +1505,7 @@ class BlueZ():
         """
 
         dbus_value = dbus.Boolean(value)
-        self.device.Set(ADAPTER_INTERFACE, "Discoverable", dbus_value)
+        self._dev_set(ADAPTER_INTERFACE, "Discoverable", dbus_value)
 
     @property
     def discoverable_timeout(self):
@@ -841,7 +1516,7 @@ class BlueZ():
         :rtype: int
         """
 
-        return self.device.Get(ADAPTER_INTERFACE, "DiscoverableTimeout")
+        return self._adapter_property("DiscoverableTimeout")
 
     def set_discoverable_timeout(self, value):
         """Sets the discoverable time (in seconds) for the discoverable
@@ -853,7 +1528,7 @@ class BlueZ():
         """
 
         dbus_value = dbus.UInt32(value)
-        self.device.Set(
+        self._dev_set(
             ADAPTER_INTERFACE,
             "DiscoverableTimeout",
             dbus_value)
@@ -868,15 +1543,10 @@ class BlueZ():
         :rtype: string
         """
 
-        # This is another hacky bit. We're using hciconfig here instead
-        # of the D-Bus API so that results match the setter. See the
-        # setter for further justification on using hciconfig.
-        result = subprocess.run(
-            ["hciconfig", self.device_id, "class"],
-            stdout=subprocess.PIPE)
-        device_class = result.stdout.decode("utf-8").split("Class: ")[1][0:8]
-
-        return device_class
+        # This is another hacky bit. We're reading the class over HCI
+        # instead of the D-Bus API so that results match the setter.
+        # See the setter for further justification on using HCI.
+        return _read_class_of_dev(_hci_device_id(self.device_id))
 
     def set_device_class(self, device_class):
         """Sets the Bluetooth class of the device. This represents what type
@@ -898,16 +1568,10 @@ class BlueZ():
             raise ValueError("Device class must be length 8")
 
         # This is a bit of a hack. BlueZ allows you to set this value, however,
-        # a config file needs to filled and the BT daemon restarted. This is a
-        # good compromise but requires super user privileges. Not ideal.
-        result = subprocess.run(
-            ["hciconfig", self.device_id, "class", device_class],
-            stderr=subprocess.PIPE)
-
-        # Checking if there was a problem setting the device class
-        cmd_err = result.stderr.decode("utf-8").replace("\n", "")
-        if cmd_err != "":
-            raise Exception(cmd_err)
+        # a config file needs to filled and the BT daemon restarted. Writing
+        # the class over HCI is a good compromise but requires super user
+        # privileges. Not ideal.
+        _write_class_of_dev(_hci_device_id(self.device_id), device_class)
 
     @property
     def powered(self):
@@ -917,7 +1581,7 @@ class BlueZ():
         :rtype: boolean
         """
 
-        return bool(self.device.Get(ADAPTER_INTERFACE, "Powered"))
+        return bool(self._adapter_property("Powered"))
 
     def set_powered(self, value):
         """Switches the adapter on or off.
@@ -927,7 +1591,7 @@ class BlueZ():
         """
 
         dbus_value = dbus.Boolean(value)
-        self.device.Set(ADAPTER_INTERFACE, "Powered", dbus_value)
+        self._dev_set(ADAPTER_INTERFACE, "Powered", dbus_value)
 
     def register_profile(self, profile_path, uuid, opts):
         """Registers an SDP record on the BlueZ SDP server.
@@ -970,41 +1634,59 @@ class BlueZ():
 
         self.profile_manager.UnregisterProfile(profile)
 
+    def ensure_agent(self):
+        """Registers the auto-accept agent if it isn't registered
+        already. This is needed before the adapter can accept
+        pairing and authorization requests.
+        """
+
+        if self.agent is None:
+            self._register_agent()
+
     def _register_agent(self):
         """Registers an auto-accept agent to handle pairing and authorization requests."""
         try:
             # Create and register the agent
             self.agent = AutoAcceptAgent(self.bus, self.agent_path)
             
-            # Get the agent manager
-            agent_manager = dbus.Interface(
-                self.bus.get_object(SERVICE_NAME, "/org/bluez"),
-                AGENTMANAGER_INTERFACE)
-            
             # Register the agent with NoInputNoOutput capability
-            agent_manager.RegisterAgent(self.agent_path, "NoInputNoOutput")
+            self._agent_manager.RegisterAgent(
+                self.agent_path, "NoInputNoOutput")
             
             # Request to make this the default agent
-            agent_manager.RequestDefaultAgent(self.agent_path)
+            self._agent_manager.RequestDefaultAgent(self.agent_path)
             
             self.logger.debug("Auto-accept agent registered successfully")
         except dbus.exceptions.DBusException as e:
             # Agent might already be registered, which is fine
             self.logger.debug(f"Agent registration: {e}")
 
+        # BlueZ doesn't list its registered agents, so the agent is
+        # advertised under a well-known name instead. The system bus
+        # policy may not allow owning it, which only costs the
+        # advertisement.
+        try:
+            self.bus.request_name(
+                AGENT_BUS_NAME, dbus.bus.NAME_FLAG_DO_NOT_QUEUE)
+        except dbus.exceptions.DBusException as e:
+            self.logger.debug(f"Agent bus name: {e}")
+
     def _unregister_agent(self):
         """Unregisters the auto-accept agent."""
         if self.agent:
             try:
-                agent_manager = dbus.Interface(
-                    self.bus.get_object(SERVICE_NAME, "/org/bluez"),
-                    AGENTMANAGER_INTERFACE)
-                agent_manager.UnregisterAgent(self.agent_path)
+                self._agent_manager.UnregisterAgent(self.agent_path)
                 self.logger.debug("Agent unregistered")
             except dbus.exceptions.DBusException as e:
                 self.logger.debug(f"Agent unregistration: {e}")
             finally:
+                # Free the object path so the agent can be exported again
+                self.agent.remove_from_connection()
                 self.agent = None
+                try:
+                    self.bus.release_name(AGENT_BUS_NAME)
+                except dbus.exceptions.DBusException as e:
+                    self.logger.debug(f"Agent bus name release: {e}")
 
     def reset(self):
         """Restarts the Bluetooth Service
@@ -1013,29 +1695,19 @@ class BlueZ():
         """
 
         # Unregister agent before restart
+        agent_registered = self.agent is not None
         self._unregister_agent()
 
-        result = subprocess.run(
-            ["systemctl", "restart", "bluetooth"],
-            stderr=subprocess.PIPE)
-
-        cmd_err = result.stderr.decode("utf-8").replace("\n", "")
-        if cmd_err != "":
-            raise Exception(cmd_err)
+        _restart_bluetooth_unit(self.bus)
 
-        self.device = dbus.Interface(
-            self.bus.get_object(
-                SERVICE_NAME,
-                self.device_path),
-            "org.freedesktop.DBus.Properties")
-        self.profile_manager = dbus.Interface(
-            self.bus.get_object(
-                SERVICE_NAME,
-                BLUEZ_OBJECT_PATH),
-            PROFILEMANAGER_INTERFACE)
+        # The restarted daemon doesn't announce the objects it dropped,
+        # so reseed the mirror now that it's back up
+        self._bind_proxies()
+        self._seed_objects()
 
-        # Re-register agent after restart
-        self._register_agent()
+        # Re-register agent after restart, if it was in use
+        if agent_registered:
+            self._register_agent()
 
     def get_discovered_devices(self):
         """Gets a dict of all discovered (or previously discovered
@@ -1054,17 +1726,9 @@ class BlueZ():
         :rtype: dictionary
         """
 
-        bluez_objects = dbus.Interface(
-            self.bus.get_object(SERVICE_NAME, "/"),
-            "org.freedesktop.DBus.ObjectManager")
-
-        devices = {}
-        objects = bluez_objects.GetManagedObjects()
-        for path, interfaces in list(objects.items()):
-            if DEVICE_INTERFACE in interfaces:
-                devices[str(path)] = interfaces[DEVICE_INTERFACE]
-
-        return devices
+        return {
+            path: dict(props)
+            for path, props in self._get_all_devices_cached().items()}
 
     def discover_devices(self, alias=None, timeout=10, callback=None):
         """Runs a device discovery of the timeout length (in seconds)
@@ -1102,22 +1766,65 @@ class BlueZ():
         # Get all devices that have been previously discovered
         devices = self.get_discovered_devices()
 
+        # Update the devices as BlueZ reports them, rather than
+        # re-reading every device each second
+        def on_interfaces_added(path, interfaces):
+            if DEVICE_INTERFACE in interfaces:
+                devices[str(path)] = dict(interfaces[DEVICE_INTERFACE])
+
+        def on_properties_changed(interface, changed, invalidated,
+                                  path=None):
+            if interface == DEVICE_INTERFACE and str(path) in devices:
+                devices[str(path)].update(changed)
+
+        matches = [
+            self.bus.add_signal_receiver(
+                on_interfaces_added,
+                dbus_interface="org.freedesktop.DBus.ObjectManager",
+                signal_name="InterfacesAdded",
+                bus_name=SERVICE_NAME),
+            self.bus.add_signal_receiver(
+                on_properties_changed,
+                dbus_interface="org.freedesktop.DBus.Properties",
+                signal_name="PropertiesChanged",
+                bus_name=SERVICE_NAME,
+                path_keyword="path"),
+        ]
+
+        # Run the callback every second until the timeout elapses,
+        # dispatching signals in between
+        loop = GLib.MainLoop()
+        elapsed = 0
+        callback_error = None
+
+        def tick():
+            nonlocal elapsed, callback_error
+            elapsed += 1
+            try:
+                if callback:
+                    callback(devices)
+            except Exception as e:
+                callback_error = e
+                loop.quit()
+                return False
+            if elapsed >= timeout:
+                loop.quit()
+                return False
+            return True
+
         # Start discovering new devices and loop
         self.set_powered(True)
         self.set_pairable(True)
         self.adapter.StartDiscovery()
         try:
-            for i in range(0, timeout):
-                time.sleep(1)
-
-                new_devices = self.get_discovered_devices()
-                # Shallowly merging dictionaries. Latter dictionary
-                # overrides the former. Requires Python 3.5
-                devices = {**devices, **new_devices}
-
-                if callback:
-                    callback(devices)
+            if timeout > 0:
+                GLib.timeout_add_seconds(1, tick)
+                loop.run()
+            if callback_error is not None:
+                raise callback_error
         finally:
+            for match in matches:
+                match.remove()
             self.adapter.StopDiscovery()
             time.sleep(1)
 
@@ -1148,20 +1855,12 @@ class BlueZ():
         :type device_path: string
         """
 
-        device = dbus.Interface(
-            self.bus.get_object(
-                SERVICE_NAME,
-                device_path),
-            DEVICE_INTERFACE)
+        device, _ = self._get_device_proxies(device_path)
         device.Pair()
 
     def connect_device(self, device_path):
 
-        device = dbus.Interface(
-            self.bus.get_object(
-                SERVICE_NAME,
-                device_path),
-            DEVICE_INTERFACE)
+        device, _ = self._get_device_proxies(device_path)
         try:
             device.Connect()
         except dbus.exceptions.DBusException as e:
@@ -1175,8 +1874,9 @@ class BlueZ():
         :type path: string
         """
 
-        self.adapter.RemoveDevice(
-            self.bus.get_object(SERVICE_NAME, path))
+        self.adapter.RemoveDevice(dbus.ObjectPath(path))
+        self._dev_proxies.pop(str(path), None)
+        _invalidate_managed_objects(self.bus)
 
     def find_device_by_address(self, address):
         """Finds the D-Bus path to a device that contains the
@@ -1188,64 +1888,54 @@ class BlueZ():
         :rtype: string or None
         """
 
-        # Find all connected/paired/discovered devices
-        devices = find_objects(
-            self.bus,
-            SERVICE_NAME,
-            DEVICE_INTERFACE)
-        for path in devices:
-            # Get the device's address and paired status
-            device_props = dbus.Interface(
-                self.bus.get_object(SERVICE_NAME, path),
-                "org.freedesktop.DBus.Properties")
-            device_addr = device_props.Get(
-                DEVICE_INTERFACE,
-                "Address").upper()
-
-            # Check for an address match
-            if device_addr != address.upper():
-                continue
-            return path
+        # Dispatch queued signals first, as they invalidate the index
+        devices = self._get_all_devices_cached()
+        if self._addr_index is None:
+            self._addr_index = {
+                str(props["Address"]).upper(): path
+                for path, props in devices.items() if "Address" in props}
 
-        return None
+        return self._addr_index.get(address.upper())
     
     def find_connected_devices(self, alias_filter=False):
-        """Finds the D-Bus path to a device that contains the
-        specified address.
-
-        :param address: The Bluetooth MAC address
-        :type address: string
-        :return: The path to the D-Bus object or None
-        :rtype: string or None
+        """Finds the D-Bus paths of all connected devices,
+        optionally only those with a given alias.
+
+        :param alias_filter: The alias of the devices to find,
+        ignoring case, defaults to False (no filter)
+        :type alias_filter: string, optional
+        :return: The paths to the connected D-Bus objects
+        :rtype: list
         """
 
-        devices = find_objects(
-            self.bus,
-            SERVICE_NAME,
-            DEVICE_INTERFACE)
+        upper_filter = alias_filter.upper() if alias_filter else None
+
+        # Device paths come from the mirrored object tree, but each
+        # connection status is read live. The connection watchdog
+        # relies on this, and the mirror is only as fresh as the last
+        # signal dispatch.
         conn_devices = []
-        for path in devices:
-            # Get the device's connection status
-            device_props = dbus.Interface(
-                self.bus.get_object(SERVICE_NAME, path),
-                "org.freedesktop.DBus.Properties")
-            device_conn_status = device_props.Get(
-                DEVICE_INTERFACE,
-                "Connected")
-            device_alias = device_props.Get(
-                DEVICE_INTERFACE,
-                "Alias").upper()
-
-            if device_conn_status:
-                if alias_filter and device_alias == alias_filter.upper():
-                    conn_devices.append(path)
-                else:
-                    conn_devices.append(path)
+        for path in self._get_all_devices_cached():
+            try:
+                props = self._get_proxy(
+                    path, "org.freedesktop.DBus.Properties").GetAll(
+                        DEVICE_INTERFACE)
+            except dbus.exceptions.DBusException:
+                # The device was removed after the mirror was read
+                continue
+            if not props.get("Connected", False):
+                continue
+            if (upper_filter is not None and
+                    props.get("Alias", "").upper() != upper_filter):
+                continue
+            conn_devices.append(path)
 
         return conn_devices
 
     def close(self):
-        """Cleanup method to unregister agent and close bus connection."""
+        """Cleanup method to unregister the agent and stop mirroring
+        BlueZ objects. The bus itself is shared and is left open."""
         self._unregister_agent()
-        if hasattr(self, 'bus') and self.bus:
-            self.bus.close()
+        for match in getattr(self, '_signal_matches', []):
+            match.remove()
+        self._signal_matches = []
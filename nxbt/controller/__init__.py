@@ -1,6 +1,8 @@
 from .server import ControllerServer
+from .server import CONTROLLER_STATES
 from .controller import ControllerTypes
 from .controller import Controller
+from .input import DirectInputSlots
 from .protocol import ControllerProtocol
 from .protocol import SwitchReportParser
 from .protocol import SwitchResponses
@@ -1,5 +1,8 @@
 from time import perf_counter
 from json import dumps
+from multiprocessing import RawArray
+from threading import Lock
+import struct
 
 
 DIRECT_INPUT_IDLE_PACKET = {
@@ -51,6 +54,124 @@ DIRECT_INPUT_IDLE_PACKET = {
     "A": False
 }
 
+# The fields of a direct input packet as (stick, key) pairs, in the
+# packet's own order. Button fields have no stick.
+_PACKET_FIELDS = tuple(
+    (key, sub_key) if isinstance(value, dict) else (None, key)
+    for key, value in DIRECT_INPUT_IDLE_PACKET.items()
+    for sub_key in (value if isinstance(value, dict) else (key,)))
+
+# A slot holds a write sequence number followed by the packed packet,
+# with the analog stick values as doubles and everything else as bools.
+# The sequence number is odd while a write is in progress.
+_SLOT_SEQUENCE = struct.Struct("=Q")
+_SLOT_PACKET = struct.Struct("=" + "".join(
+    "d" if key in ("X_VALUE", "Y_VALUE") else "?"
+    for _, key in _PACKET_FIELDS))
+_SLOT_SIZE = _SLOT_SEQUENCE.size + _SLOT_PACKET.size
+# How many times a read is retried when it overlaps a write before the
+# reader gives up until its next cycle
+_SLOT_READ_ATTEMPTS = 3
+
+
+class DirectInputSlots():
+    """A fixed number of direct input packets held in shared memory.
+    Each slot stores the latest packet written for one controller,
+    packed into a fixed layout, so that the controller process can
+    read it every cycle without a round trip to a Manager process.
+
+    The slots must be created before the processes that use them
+    are forked, since the shared memory is passed by inheritance.
+
+    Reads take no lock, so a reader that's terminated mid-read can't
+    leave a slot locked. Each slot is a seqlock instead: the writer
+    makes the sequence number odd while it writes, and a reader
+    discards any read that overlapped a write. Writes only come from
+    the process that owns the Nxbt object, so writers are serialized
+    with a lock local to that process.
+    """
+
+    def __init__(self, count):
+
+        self.count = count
+        self._buffers = [RawArray('B', _SLOT_SIZE) for _ in range(count)]
+        self._write_lock = Lock()
+
+    def write(self, slot, packet):
+        """Stores a direct input packet in a slot, replacing the
+        previously stored packet.
+
+        :param slot: The index of the slot
+        :type slot: int
+        :param packet: A direct input packet
+        :type packet: dict
+        """
+
+        values = [
+            packet[key] if stick is None else packet[stick][key]
+            for stick, key in _PACKET_FIELDS]
+
+        buffer = self._buffers[slot]
+        with self._write_lock:
+            sequence = _SLOT_SEQUENCE.unpack_from(buffer)[0]
+            _SLOT_SEQUENCE.pack_into(buffer, 0, sequence + 1)
+            _SLOT_PACKET.pack_into(
+                buffer, _SLOT_SEQUENCE.size, *values)
+            _SLOT_SEQUENCE.pack_into(buffer, 0, sequence + 2)
+
+    def read(self, slot, last_sequence=0):
+        """Reads the packet stored in a slot if it has been written
+        since a given sequence number.
+
+        :param slot: The index of the slot
+        :type slot: int
+        :param last_sequence: The sequence number of the last packet
+        read from this slot, defaults to 0
+        :type last_sequence: int, optional
+        :return: The slot's sequence number and its packet, or None
+        in place of the packet if nothing new could be read
+        :rtype: tuple
+        """
+
+        buffer = self._buffers[slot]
+        for _ in range(_SLOT_READ_ATTEMPTS):
+            sequence = _SLOT_SEQUENCE.unpack_from(buffer)[0]
+            if sequence == last_sequence:
+                return sequence, None
+            if sequence & 1:
+                # A write is in progress
+                continue
+            values = _SLOT_PACKET.unpack_from(buffer, _SLOT_SEQUENCE.size)
+            if _SLOT_SEQUENCE.unpack_from(buffer)[0] == sequence:
+                break
+        else:
+            # Still being written, so try again on the next read
+            return last_sequence, None
+
+        packet = {}
+        for (stick, key), value in zip(_PACKET_FIELDS, values):
+            if stick is None:
+                packet[key] = value
+                continue
+            if isinstance(value, float) and value.is_integer():
+                # Whole values are stored back as ints so that idle
+                # packets still compare equal to the idle packet.
+                value = int(value)
+            packet.setdefault(stick, {})[key] = value
+
+        return sequence, packet
+
+    def clear(self, slot):
+        """Empties a slot so that it can be reused by another controller.
+        This must only be done once the slot's reader has exited.
+
+        :param slot: The index of the slot
+        :type slot: int
+        """
+
+        with self._write_lock:
+            self._buffers[slot][:] = bytes(_SLOT_SIZE)
+
 
 class InputParser():
 
@@ -75,6 +196,10 @@ class InputParser():
         "max_y": 1510,
     }
 
+    # The furthest, in seconds, a macro command may start behind
+    # its deadline before macro timing is re-anchored
+    MACRO_MAX_LAG = 0.1
+
     def __init__(self, protocol):
 
         self.protocol = protocol
@@ -96,6 +221,12 @@ class InputParser():
         # The start time for the current macro commands
         self.macro_timer_start = 0
 
+        # The absolute end time of the previous command in the
+        # current macro. The next command starts at this deadline,
+        # rather than whenever it happens to be loaded, so that
+        # timing error doesn't accumulate over long macro loops.
+        self.macro_deadline = None
+
         self.controller_input = None
 
         # Whether or not input has been entered
@@ -134,6 +265,7 @@ class InputParser():
             self.current_macro_commands = None
             self.macro_timer_length = 0
             self.macro_timer_start = 0
+            self.macro_deadline = None
         else:
             # Check if the macro is still in the buffer
             for i in range(0, len(self.macro_buffer)):
@@ -157,6 +289,7 @@ class InputParser():
         self.current_macro_commands = None
         self.macro_timer_length = 0
         self.macro_timer_start = 0
+        self.macro_deadline = None
         self.macro_buffer = []
         self.total_macro_lines = 0
         self.completed_macro_lines = 0
@@ -205,7 +338,8 @@ class InputParser():
         :rtype: bool
         """
         if (self.current_macro_commands is not None):
-            if len(self.current_macro_commands) < 2:
+            # Wait commands have no compiled input
+            if self.current_macro_commands[0] is None:
                 return False
             else:
                 return True
@@ -258,11 +392,20 @@ class InputParser():
                 if time_since_last_macro >= self.macro_cooldown_time:
                     # Preprocess command lines of current macro
                     macro = self.macro_buffer.pop(0)
-                    self.current_macro = self.parse_macro(macro[0])
+                    commands, total_lines = self.parse_macro(macro[0])
+                    self.current_macro = self.iterate_macro(commands)
                     self.current_macro_id = macro[1]
                     # Track total lines for progress
-                    self.total_macro_lines = len(self.current_macro)
+                    self.total_macro_lines = total_lines
                     self.completed_macro_lines = 0
+                    if not total_lines:
+                        # Nothing to input, so the macro is already done
+                        self.current_macro = None
+                        if state:
+                            finished = state["finished_macros"]
+                            finished.append(self.current_macro_id)
+                            state["finished_macros"] = finished
+                        return
                 else:
                     # Not enough time has passed, send neutral inputs while waiting
                     self.protocol.set_button_inputs(0, 0, 0)
@@ -274,27 +417,33 @@ class InputParser():
 
             # Check if we can load the next set of commands
             if not self.current_macro_commands and self.current_macro:
-                self.current_macro_commands = (
-                    self.current_macro.pop(0).strip(" ").split(" "))
-
-                # Timing metadata extraction
-                timer_length = self.current_macro_commands[-1]
-                timer_length = timer_length[0:len(timer_length)-1]
-                self.macro_timer_length = float(timer_length)
-                self.macro_timer_start = perf_counter()
-
-            self.set_macro_input(self.current_macro_commands)
+                self.current_macro_commands = next(self.current_macro)
+                self.macro_timer_length = self.current_macro_commands[1]
+                now = perf_counter()
+                # Re-anchor to the current time if the deadline has
+                # fallen far behind (Eg: after a stall), instead of
+                # rushing through the missed commands.
+                if (self.macro_deadline is None or
+                        now - self.macro_deadline > self.MACRO_MAX_LAG):
+                    self.macro_deadline = now
+                self.macro_timer_start = self.macro_deadline
+
+            self.set_macro_input(self.current_macro_commands[0])
 
             # Check if we're done inputting the current command
             time_delta = perf_counter() - self.macro_timer_start
             if time_delta > self.macro_timer_length:
                 self.current_macro_commands = None
+                self.macro_deadline = (
+                    self.macro_timer_start + self.macro_timer_length)
                 # Track completed lines for progress
                 self.completed_macro_lines += 1
                 # Check if we're done the current macro
-                if not self.current_macro:
+                if self.completed_macro_lines >= self.total_macro_lines:
+                    self.current_macro = None
                     # Start post-macro neutral state period
                     self.post_macro_neutral_cycles = self.post_macro_neutral_required
+                    self.macro_deadline = None
                     
                     # Reset all button inputs to neutral state when macro completes
                     self.protocol.set_button_inputs(0, 0, 0)
@@ -400,15 +549,38 @@ class InputParser():
         return controller_input
 
     def parse_macro(self, macro):
+        """Compiles a macro into a list of commands. Each distinct
+        line is compiled only once, and loops are kept as their
+        compiled body and a repeat count rather than multiplied out,
+        so long-running loops take no more memory than a single pass.
+
+        :param macro: The macro string
+        :type macro: str
+        :return: The compiled commands (see parse_loops) and the
+        total number of commands the macro inputs
+        :rtype: tuple
+        """
 
         parsed = macro.split("\n")
         parsed = list(filter(lambda s: not s.strip() == "", parsed))
         parsed = list(filter(lambda s: not s.strip().startswith("#"), parsed))
-        parsed = self.parse_loops(parsed)
+        parsed = self.parse_loops(parsed, {})
 
-        return parsed
+        return parsed, self.count_macro_commands(parsed)
+
+    def parse_loops(self, macro, compiled):
+        """Compiles macro lines, gathering loops into lists of the
+        form [loop_count, commands]. Each other command is a tuple of
+        its compiled input (None for waits) and its length in seconds.
+
+        :param macro: The macro's lines
+        :type macro: list
+        :param compiled: Already compiled commands, keyed by line
+        :type compiled: dict
+        :return: The compiled commands
+        :rtype: list
+        """
 
-    def parse_loops(self, macro):
         parsed = []
         i = 0
         while i < len(macro):
@@ -440,27 +612,78 @@ class InputParser():
                     if j+1 >= len(macro):
                         i = j
 
-                # Recursively gather other loops if present
-                if any(s.startswith("LOOP") for s in loop_buffer):
-                    loop_buffer = self.parse_loops(loop_buffer)
-                # Multiply out the loop and concatenate
-                parsed = parsed + (loop_buffer * loop_count)
+                # Recursively compile the loop's commands, including
+                # any other loops present
+                parsed.append(
+                    [loop_count, self.parse_loops(loop_buffer, compiled)])
             else:
-                parsed.append(line)
+                command = compiled.get(line)
+                if command is None:
+                    macro_input = line.strip(" ").split(" ")
+                    # Timing metadata extraction
+                    timer_length = macro_input[-1]
+                    timer_length = timer_length[0:len(timer_length)-1]
+                    command = (self.compile_macro_input(macro_input),
+                               float(timer_length))
+                    compiled[line] = command
+                parsed.append(command)
             i += 1
 
         return parsed
 
-    def set_macro_input(self, macro_input):
+    def count_macro_commands(self, commands):
+        """Counts the commands a compiled macro inputs, with loops
+        multiplied out.
+
+        :param commands: The compiled commands
+        :type commands: list
+        :return: The number of commands
+        :rtype: int
+        """
+
+        count = 0
+        for command in commands:
+            if isinstance(command, list):
+                count += command[0] * self.count_macro_commands(command[1])
+            else:
+                count += 1
+        return count
+
+    def iterate_macro(self, commands):
+        """Yields each command of a compiled macro in input order,
+        repeating loops as it goes.
+
+        :param commands: The compiled commands
+        :type commands: list
+        """
+
+        for command in commands:
+            if isinstance(command, list):
+                for _ in range(command[0]):
+                    yield from self.iterate_macro(command[1])
+            else:
+                yield command
+
+    def compile_macro_input(self, macro_input):
+        """Converts the buttons and stick positions of a split macro
+        line into the values the protocol is set with.
+
+        :param macro_input: A macro line split into its tokens,
+        ending with the timing token
+        :type macro_input: list
+        :return: The three button bytes, the left and right stick
+        positions (None if unset) and whether the input would close
+        the "Change Grip/Order" menu. None for wait commands.
+        :rtype: tuple or None
+        """
 
         # Checking if this is a wait macro command
         if len(macro_input) < 2:
-            return
+            return None
 
         # Check if the Grip/Order menu would be closed
-        if not self.exited_grip_order_menu and (
-                'A' in macro_input or 'B' in macro_input or 'HOME' in macro_input):
-            self.exited_grip_order_menu = True
+        exits_grip_order_menu = (
+            'A' in macro_input or 'B' in macro_input or 'HOME' in macro_input)
 
         # Arrays representing the 3 button bytes in the
         # standard input report as binary.
@@ -533,6 +756,22 @@ class InputParser():
         shared_byte = int("".join(shared), 2)
         lower_byte = int("".join(lower), 2)
 
+        return (upper_byte, shared_byte, lower_byte,
+                stick_left, stick_right, exits_grip_order_menu)
+
+    def set_macro_input(self, macro_input):
+
+        # Checking if this is a wait macro command
+        if macro_input is None:
+            return
+
+        (upper_byte, shared_byte, lower_byte,
+         stick_left, stick_right, exits_grip_order_menu) = macro_input
+
+        # Check if the Grip/Order menu would be closed
+        if not self.exited_grip_order_menu and exits_grip_order_menu:
+            self.exited_grip_order_menu = True
+
         self.protocol.set_button_inputs(upper_byte, shared_byte, lower_byte)
         if stick_left:
             self.protocol.set_left_stick_inputs(stick_left)
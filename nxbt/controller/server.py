@@ -12,15 +12,23 @@ import statistics as stat
 from .controller import Controller, ControllerTypes
 from ..bluez import BlueZ, find_devices_by_alias
 from .protocol import ControllerProtocol
-from .input import InputParser
+from .input import InputParser, DIRECT_INPUT_IDLE_PACKET
 from .utils import format_msg_controller, format_msg_switch
 
 
+# The states a controller can be in. A state's index in this tuple is
+# the code it's published under in shared memory.
+CONTROLLER_STATES = (
+    "initializing", "connecting", "reconnecting", "connected", "crashed")
+
+
 class ControllerServer():
 
     def __init__(self, controller_type, adapter_path="/org/bluez/hci0",
                  state=None, task_queue=None, lock=None, colour_body=None,
-                 colour_buttons=None):
+                 colour_buttons=None, input_slots=None, input_slot=None,
+                 cpu_affinity=None, realtime_priority=None,
+                 state_semaphore=None, state_code=None, disable_sniff=False):
 
         self.logger = logging.getLogger('nxbt')
         # Cache logging level to increase performance on checks
@@ -40,6 +48,28 @@ class ControllerServer():
 
         self.task_queue = task_queue
 
+        # Direct input is read from a shared memory slot when one is
+        # given, rather than from the shared state.
+        self.input_slots = input_slots
+        self.input_slot = input_slot
+        self._input_sequence = 0
+        # Until a packet is written, the controller is idle
+        self._direct_input = DIRECT_INPUT_IDLE_PACKET
+
+        # Released on every change of the "state" value, so that other
+        # processes can wait on it rather than poll
+        self.state_semaphore = state_semaphore
+        # A shared memory byte mirroring the "state" value as an
+        # index into CONTROLLER_STATES, readable without the Manager
+        self.state_code = state_code
+
+        # Whether to keep the Switch's link out of sniff mode
+        self.disable_sniff = disable_sniff
+
+        # Optional scheduling of the input loop
+        self.cpu_affinity = cpu_affinity
+        self.realtime_priority = realtime_priority
+
         self.controller_type = controller_type
         self.colour_body = colour_body
         self.colour_buttons = colour_buttons
@@ -64,6 +94,9 @@ class ControllerServer():
         # Debug timekeeping storage array
         self.times = []
 
+        # The last macro progress published to the state
+        self._macro_progress = None
+
         # Initial reconnection overload protection
         self.tick = 1
         self.cached_msg = ''
@@ -76,7 +109,7 @@ class ControllerServer():
         :type reconnect_address: string or list, optional
         """
 
-        self.state["state"] = "initializing"
+        self._set_state("initializing")
 
         try:
             # If we have a lock, prevent other controllers
@@ -100,22 +133,76 @@ class ControllerServer():
 
             self.switch_address = itr.getpeername()[0]
             self.state["last_connection"] = self.switch_address
+            self._set_link_policy()
 
-            self.state["state"] = "connected"
+            self._set_state("connected")
 
+            self._set_loop_scheduling()
             self.mainloop(itr, ctrl)
 
         except KeyboardInterrupt:
             pass
         except Exception:
             try:
-                self.state["state"] = "crashed"
                 self.state["errors"] = traceback.format_exc()
+                self._set_state("crashed")
                 return self.state
             except Exception as e:
                 self.logger.debug("Error during graceful shutdown:")
                 self.logger.debug(traceback.format_exc())
 
+    def _set_state(self, state):
+        """Sets the controller's state and wakes a process
+        waiting on a state change.
+
+        :param state: The new state, Eg: "connected"
+        :type state: str
+        """
+
+        self.state["state"] = state
+        if self.state_code is not None:
+            self.state_code.value = CONTROLLER_STATES.index(state)
+        if self.state_semaphore is not None:
+            self.state_semaphore.release()
+
+    def _set_link_policy(self):
+        """Keeps the link to the connected Switch in active mode, if
+        requested. Failures are logged, since the link still works
+        in sniff mode, only with more latency.
+        """
+
+        if not self.disable_sniff:
+            return
+        try:
+            self.bt.disable_sniff_mode(self.switch_address)
+        except Exception as e:
+            self.logger.warning(f"Unable to disable sniff mode: {e}")
+
+    def _set_loop_scheduling(self, realtime=True):
+        """Pins the calling thread (the input loop) to the requested
+        CPUs and raises it to the requested SCHED_FIFO priority.
+        Both only improve input timing, so failures (Eg: without
+        root) are logged rather than raised.
+
+        :param realtime: Whether to use SCHED_FIFO, or to return the
+        thread to the normal scheduler (Eg: while re-pairing),
+        defaults to True
+        :type realtime: bool, optional
+        """
+
+        try:
+            if self.cpu_affinity:
+                os.sched_setaffinity(0, self.cpu_affinity)
+            if self.realtime_priority and realtime:
+                os.sched_setscheduler(
+                    0, os.SCHED_FIFO,
+                    os.sched_param(self.realtime_priority))
+            elif self.realtime_priority:
+                os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+        except (OSError, AttributeError) as e:
+            self.logger.warning(
+                f"Unable to set the input loop's scheduling: {e}")
+
     def mainloop(self, itr, ctrl):
 
         duration_start = time.perf_counter()
@@ -148,14 +235,27 @@ class ControllerServer():
                     pass
 
             # Set Direct Input
-            if self.state["direct_input"]:
-                self.input.set_controller_input(self.state["direct_input"])
+            if self.input_slots is not None:
+                sequence, packet = self.input_slots.read(
+                    self.input_slot, self._input_sequence)
+                if packet:
+                    self._input_sequence = sequence
+                    self._direct_input = packet
+                direct_input = self._direct_input
+            else:
+                direct_input = self.state.get("direct_input")
+            if direct_input:
+                self.input.set_controller_input(direct_input)
 
             self.protocol.process_commands(reply)
             self.input.set_protocol_input(state=self.state)
             
-            # Update macro progress in state
-            self.state["macro_progress"] = self.input.get_macro_progress()
+            # Update macro progress in state, only when it changes
+            # since each write is a round trip to the Manager
+            macro_progress = self.input.get_macro_progress()
+            if macro_progress != self._macro_progress:
+                self.state["macro_progress"] = macro_progress
+                self._macro_progress = macro_progress
 
             msg = self.protocol.get_report()
 
@@ -163,16 +263,20 @@ class ControllerServer():
                 self.logger.debug(format_msg_controller(msg))
 
             try:
+                # The interrupt channel is a SOCK_SEQPACKET socket, so
+                # each report goes out whole in a single send() call
+                # and sendall()'s partial-write loop isn't needed.
                 # Cache the last packet to prevent overloading the switch
                 # with packets on the "Change Grip/Order" menu.
-                if msg[3:] != self.cached_msg:
-                    itr.sendall(msg)
-                    self.cached_msg = msg[3:]
+                msg_body = msg[3:]
+                if msg_body != self.cached_msg:
+                    itr.send(msg)
+                    self.cached_msg = msg_body
                     self.tick = 0  # Reset tick on new packet
                 # Send a blank packet every so often to keep the Switch
                 # from disconnecting from the controller.
                 elif self.tick >= 132:
-                    itr.sendall(msg)
+                    itr.send(msg)
                     self.tick = 0
             except BlockingIOError:
                 continue
@@ -208,6 +312,10 @@ class ControllerServer():
         can occur with Bluetooth connections.
         """
 
+        # Re-pairing runs on the normal scheduler, like the first
+        # connection, and the input loop's priority is restored after
+        self._set_loop_scheduling(realtime=False)
+
         while True:
             try:
                 self.reconnect_counter += 1
@@ -263,9 +371,11 @@ class ControllerServer():
                         else:
                             time.sleep(1/15)
 
-                    self.state["state"] = "connected"
+                    self._set_link_policy()
+                    self._set_state("connected")
                     self.reconnect_counter = 0  # Reset counter on successful reconnection
                     self.logger.debug("Reconnection successful")
+                    self._set_loop_scheduling()
                     return itr, ctrl
                 finally:
                     if self.lock:
@@ -323,7 +433,7 @@ class ControllerServer():
         # disconnect during a connection.
         while True:
             try:
-                self.state["state"] = "connecting"
+                self._set_state("connecting")
 
                 # Creating control and interrupt sockets
                 s_ctrl = socket.socket(
@@ -449,7 +559,7 @@ class ControllerServer():
 
             return itr, ctrl
 
-        self.state["state"] = "reconnecting"
+        self._set_state("reconnecting")
 
         # Prepare the adapter for reconnection by restoring the stored MAC address
         # The Switch remembers the controller's MAC address and will only accept
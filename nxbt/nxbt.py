@@ -1,4 +1,5 @@
-from multiprocessing import Process, Lock, Queue, Manager
+from multiprocessing import Process, Lock, Queue, Manager, Semaphore
+from multiprocessing import RawValue
 import queue
 from enum import Enum
 import atexit
@@ -8,15 +9,16 @@ import sys
 import time
 import json
 
-import dbus
-
 from .controller import ControllerServer
 from .controller import ControllerTypes
+from .controller import DirectInputSlots
+from .controller import CONTROLLER_STATES
 from .bluez import BlueZ, find_objects, toggle_clean_bluez
 from .bluez import replace_mac_addresses
 from .bluez import find_devices_by_alias
 from .bluez import get_stored_switch_addresses
 from .bluez import SERVICE_NAME, ADAPTER_INTERFACE
+from .bluez import _shared_bus
 from .logging import create_logger
 
 
@@ -24,6 +26,17 @@ JOYCON_L = ControllerTypes.JOYCON_L
 JOYCON_R = ControllerTypes.JOYCON_R
 PRO_CONTROLLER = ControllerTypes.PRO_CONTROLLER
 
+# The number of controllers that can exist at once.
+# A Nintendo Switch accepts at most 8 controllers.
+INPUT_SLOT_COUNT = 8
+
+# The longest, in seconds, a state wait goes without re-checking the
+# state, in case a controller process died without waking waiters
+STATE_WAIT_INTERVAL = 1
+
+# Seconds a terminated controller process gets to exit before it's killed
+CONTROLLER_STOP_TIMEOUT = 5
+
 
 DIRECT_INPUT_PACKET = {
     # Sticks
@@ -176,6 +189,25 @@ class Nxbt():
         self._controller_counter = 0
         self._adapters_in_use = {}
         self._controller_adapter_lookup = {}
+        # DBus paths of the system's adapters, scanned on first use
+        self._available_adapters = None
+
+        # Shared memory slots carrying each controller's direct input.
+        # These must exist before the manager process is started so
+        # that they're inherited by it and the controllers it spawns.
+        self._input_slots = DirectInputSlots(INPUT_SLOT_COUNT)
+        self._free_input_slots = list(range(INPUT_SLOT_COUNT))
+        self._controller_input_slots = {}
+        # Released by each slot's controller when its state changes. A
+        # semaphore holds no lock between calls, so a controller that's
+        # terminated while signalling can't leave waiters stuck.
+        self._state_semaphores = [
+            Semaphore(0) for _ in range(INPUT_SLOT_COUNT)]
+        # Slots of removed controllers, kept out of use until the
+        # manager has stopped the controller's process
+        self._released_input_slots = {}
+        # Each slot's controller state, as an index into CONTROLLER_STATES
+        self._state_codes = [RawValue('B', 0) for _ in range(INPUT_SLOT_COUNT)]
 
         # Disable the BlueZ input plugin so we can use the
         # HID control/interrupt Bluetooth ports
@@ -225,7 +257,9 @@ class Nxbt():
         :type state: multiprocessing.Manager().dict
         """
 
-        cm = _ControllerManager(state, self._bluetooth_lock)
+        cm = _ControllerManager(
+            state, self._bluetooth_lock, self._input_slots,
+            self._state_semaphores, self._state_codes)
         # Ensure a SystemExit exception is raised on SIGTERM
         # so that we can gracefully shutdown.
         signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
@@ -245,7 +279,11 @@ class Nxbt():
                             msg["arguments"]["adapter_path"],
                             msg["arguments"]["colour_body"],
                             msg["arguments"]["colour_buttons"],
-                            msg["arguments"]["reconnect_address"])
+                            msg["arguments"]["reconnect_address"],
+                            msg["arguments"]["input_slot"],
+                            msg["arguments"]["cpu_affinity"],
+                            msg["arguments"]["realtime_priority"],
+                            msg["arguments"]["disable_sniff"])
                     elif msg["command"] == NxbtCommands.INPUT_MACRO:
                         cm.input_macro(
                             msg["arguments"]["controller_index"],
@@ -292,7 +330,10 @@ class Nxbt():
         :rtype: str
         """
 
-        if controller_index not in self.manager_state.keys():
+        # The controller's state proxy is looked up once and reused
+        # for every check while blocking
+        controller_state = self.manager_state.get(controller_index)
+        if controller_state is None:
             raise ValueError("Specified controller does not exist")
 
         # Get a unique ID to identify the macro
@@ -308,12 +349,10 @@ class Nxbt():
         })
 
         if block:
-            while True:
-                finished = (self.manager_state
-                            [controller_index]["finished_macros"])
-                if macro_id in finished:
-                    break
-
+            while macro_id not in controller_state["finished_macros"]:
+                # Stop waiting if the controller was removed meanwhile
+                if controller_index not in self._controller_input_slots:
+                    raise ValueError("Specified controller does not exist")
                 time.sleep(1/120)  # Wait one Pro Controller cycle
 
         return macro_id
@@ -350,6 +389,35 @@ class Nxbt():
 
         return macro_id
 
+    def press_sequence(self, controller_index, presses, block=True):
+        """Used to press several sets of buttons one after another.
+        The presses are input as a single macro, so they run back to
+        back on the controller rather than each waiting on the task
+        queue and the cooldown between macros.
+
+        :param controller_index: The index of a given controller
+        :type controller_index: int
+        :param presses: A list of (buttons, down, up) tuples, where
+        buttons is a list of nxbt.Buttons and down and up are the
+        hold and release durations in seconds, as with press_buttons
+        :type presses: list
+        :param block: A boolean variable indicating whether or not
+        to block until the macro completes, defaults to True
+        :type block: bool, optional
+        :return: The generated ID of the passed macro. This ID
+        will show up under the "finished_macros" list communicated
+        in the controllers shared state.
+        :rtype: str
+        """
+
+        macro = "\n".join(
+            f"{' '.join(buttons)} {down}s\n{up}s"
+            for buttons, down, up in presses)
+
+        macro_id = self.macro(controller_index, macro, block=block)
+
+        return macro_id
+
     def tilt_stick(self, controller_index, stick, x, y,
                    tilted=0.1, released=0.1, block=True):
         """Used to tilt a given stick on the controller for a
@@ -380,9 +448,6 @@ class Nxbt():
         :rtype: str
         """
 
-        if controller_index not in self.manager_state.keys():
-            raise ValueError("Specified controller does not exist")
-
         if x >= 0:
             x_parsed = f'+{x:03}'
         else:
@@ -481,10 +546,35 @@ class Nxbt():
         :raises ValueError: On bad controller index
         """
 
-        if controller_index not in self.manager_state.keys():
+        input_slot = self._controller_input_slots.get(controller_index)
+        if input_slot is None:
             raise ValueError("Specified controller does not exist")
 
-        self.manager_state[controller_index]["direct_input"] = input_packet
+        self._input_slots.write(input_slot, input_packet)
+
+    def set_controller_input_batch(self, input_packets):
+        """Sets the input of several controllers for 1 cycle each, as
+        with set_controller_input. The existing controllers are looked
+        up once for the whole batch.
+
+        :param input_packets: A dictionary of controller indices to
+        input packets. Packets *must* be instances of the
+        create_input_packet method.
+        :type input_packets: dict
+        :return: The indices in the batch that don't match an
+        existing controller
+        :rtype: list
+        """
+
+        missing = []
+        for controller_index, input_packet in input_packets.items():
+            input_slot = self._controller_input_slots.get(controller_index)
+            if input_slot is None:
+                missing.append(controller_index)
+                continue
+            self._input_slots.write(input_slot, input_packet)
+
+        return missing
 
     def create_input_packet(self):
         """Creates an input packet that is used to specify the input
@@ -500,7 +590,8 @@ class Nxbt():
 
     def create_controller(self, controller_type, adapter_path=None,
                           colour_body=None, colour_buttons=None,
-                          reconnect_address=None):
+                          reconnect_address=None, cpu_affinity=None,
+                          realtime_priority=None, disable_sniff=False):
         """Used to create a Nintendo Switch controller of a
         given type and colour on an (optionally) specified
         bluetooth adapter.
@@ -530,21 +621,38 @@ class Nxbt():
         :param reconnect_address: A previously connected to
         Switch's Bluetooth MAC address, defaults to None
         :type reconnect_address: str or list, optional
+        :param cpu_affinity: The CPUs to pin the controller's input
+        loop to once connected, ideally a core isolated from the
+        scheduler (Eg: booted with isolcpus), defaults to None
+        :type cpu_affinity: set, optional
+        :param realtime_priority: A SCHED_FIFO priority (1-99) to run
+        the controller's input loop at once connected, reducing the
+        jitter of input report timing. Requires root. Defaults to None
+        :type realtime_priority: int, optional
+        :param disable_sniff: Keeps the Bluetooth link to the Switch
+        out of sniff mode once connected, so that input isn't delayed
+        by the sniff interval, defaults to False
+        :type disable_sniff: bool, optional
         :raises ValueError: If specified adapter is unavailable
         :raises ValueError: If specified adapter is in use
+        :raises ValueError: If the maximum number of controllers exist
         :return: The index of the created controller
         :rtype: int
         """
         if adapter_path:
-            if adapter_path not in self.get_available_adapters():
+            # Rescan before giving up, in case the adapter was
+            # plugged in after the adapter list was cached.
+            if (adapter_path not in self.get_available_adapters() and
+                    adapter_path not in self.get_available_adapters(refresh=True)):
                 raise ValueError("Specified adapter is unavailable")
 
             if adapter_path in self._adapters_in_use.keys():
                 raise ValueError("Specified adapter in use")
         else:
-            # Get all adapters we can use
-            usable_adapters = list(
-                set(self.get_available_adapters()) - set(self._adapters_in_use))
+            # Get all adapters we can use, in the order they were found
+            usable_adapters = self._get_usable_adapters()
+            if not usable_adapters:
+                usable_adapters = self._get_usable_adapters(refresh=True)
             if len(usable_adapters) > 0:
                 # Use the first available adapter
                 adapter_path = usable_adapters[0]
@@ -554,6 +662,10 @@ class Nxbt():
         controller_index = None
         try:
             self._controller_lock.acquire()
+            self._reclaim_input_slots()
+            if not self._free_input_slots:
+                raise ValueError("Maximum number of controllers reached")
+            input_slot = self._free_input_slots.pop(0)
             self.task_queue.put({
                 "command": NxbtCommands.CREATE_CONTROLLER,
                 "arguments": {
@@ -563,26 +675,24 @@ class Nxbt():
                     "colour_body": colour_body,
                     "colour_buttons": colour_buttons,
                     "reconnect_address": reconnect_address,
+                    "input_slot": input_slot,
+                    "cpu_affinity": cpu_affinity,
+                    "realtime_priority": realtime_priority,
+                    "disable_sniff": disable_sniff,
                 }
             })
             controller_index = self._controller_counter
             self._controller_counter += 1
             self._adapters_in_use[adapter_path] = controller_index
             self._controller_adapter_lookup[controller_index] = adapter_path
+            self._controller_input_slots[controller_index] = input_slot
 
             # Block until the controller is ready
             # This needs to be done to prevent race conditions
             # on Bluetooth resources.
             if type(controller_index) == int:
-                while True:
-                    if controller_index in self.manager_state.keys():
-                        state = self.manager_state[controller_index]
-                        if (state["state"] == "connecting" or
-                                state["state"] == "reconnecting" or
-                                state["state"] == "crashed"):
-                            break
-
-                    time.sleep(1/30)
+                self.wait_for_state(
+                    controller_index, ("connecting", "reconnecting"))
         finally:
             self._controller_lock.release()
 
@@ -602,6 +712,7 @@ class Nxbt():
                 try:
                     adapter_path = self._controller_adapter_lookup.pop(controller_index, None)
                     self._adapters_in_use.pop(adapter_path, None)
+                    self._release_input_slot(controller_index)
                 except Exception:
                     pass
             raise ValueError("Specified controller does not exist")
@@ -610,6 +721,7 @@ class Nxbt():
         try:
             adapter_path = self._controller_adapter_lookup.pop(controller_index, None)
             self._adapters_in_use.pop(adapter_path, None)
+            self._release_input_slot(controller_index)
         finally:
             self._controller_lock.release()
 
@@ -620,6 +732,57 @@ class Nxbt():
             }
         })
 
+    def reset_state(self):
+        """Removes every controller, including crashed ones, freeing
+        their adapters. This lets one Nxbt instance be reused (Eg:
+        across reconnect attempts or test runs) without restarting
+        its manager processes.
+        """
+
+        for controller_index in list(self._controller_adapter_lookup.keys()):
+            try:
+                self.remove_controller(controller_index)
+            except ValueError:
+                # Crashed controllers are freed before this is raised
+                pass
+
+    def _release_input_slot(self, controller_index):
+        """Sets aside a removed controller's input slot. The slot
+        isn't reused until _reclaim_input_slots finds that the
+        controller's process has exited, so that the process can't
+        touch the slot once another controller owns it.
+
+        :param controller_index: The index of a given controller
+        :type controller_index: int
+        """
+
+        input_slot = self._controller_input_slots.pop(controller_index, None)
+        if input_slot is not None:
+            self._released_input_slots[controller_index] = input_slot
+
+    def _reclaim_input_slots(self):
+        """Empties the input slots of removed controllers whose
+        processes have exited and returns them to the end of the free
+        list, so that they're the last to be reused. The manager only
+        drops a controller's state once its process has been joined.
+        """
+
+        if not self._released_input_slots:
+            return
+
+        live_controllers = set(self.manager_state.keys())
+        for controller_index, input_slot in list(
+                self._released_input_slots.items()):
+            if controller_index in live_controllers:
+                continue
+            del self._released_input_slots[controller_index]
+            self._input_slots.clear(input_slot)
+            self._state_codes[input_slot].value = 0
+            # Drop wakeups meant for the old controller's waiters
+            while self._state_semaphores[input_slot].acquire(False):
+                pass
+            self._free_input_slots.append(input_slot)
+
     def wait_for_connection(self, controller_index):
         """Blocks until a given controller is connected
         to a Nintendo Switch.
@@ -628,25 +791,89 @@ class Nxbt():
         :type controller_index: int
         """
 
-        while not self.state[controller_index]["state"] == "connected":
-            if self.state[controller_index]["state"] == "crashed":
-                raise OSError("The watched controller has crashe with error",
-                              self.state[controller_index]["errors"])
-            pass
+        if self.wait_for_state(controller_index, "connected") == "crashed":
+            raise OSError("The watched controller has crashe with error",
+                          self.state[controller_index]["errors"])
+
+    def wait_for_state(self, controller_index, states, timeout=None):
+        """Blocks until a given controller enters one of the given
+        states, or crashes. The controller wakes a waiter on each
+        state change, so this sleeps rather than polls. Any other
+        waiters on the same controller re-check the state within
+        STATE_WAIT_INTERVAL.
+
+        :param controller_index: The index of a given controller
+        :type controller_index: int
+        :param states: The state or states to wait for,
+        Eg: "connected"
+        :type states: str or tuple
+        :param timeout: The number of seconds to wait before giving
+        up, measured on the monotonic clock so that changes to the
+        system time don't cut it short or extend it, defaults to
+        None (no timeout)
+        :type timeout: float, optional
+        :raises ValueError: If controller does not exist
+        :return: The controller's state when the wait ended. This is
+        "crashed" on a crash, or any other state on a timeout.
+        :rtype: str
+        """
 
-    def get_available_adapters(self):
+        input_slot = self._controller_input_slots.get(controller_index)
+        if input_slot is None:
+            raise ValueError("Specified controller does not exist")
+        if isinstance(states, str):
+            states = (states,)
+
+        semaphore = self._state_semaphores[input_slot]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            state = CONTROLLER_STATES[self._state_codes[input_slot].value]
+            if state in states or state == "crashed":
+                return state
+
+            wait_time = STATE_WAIT_INTERVAL
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return state
+                wait_time = min(wait_time, remaining)
+            # Wakeups left over from earlier state changes only
+            # cause an extra check of the state
+            semaphore.acquire(timeout=wait_time)
+
+    def get_available_adapters(self, refresh=False):
         """Gets the DBus paths of all available Bluetooth
         adapters.
 
+        The adapters are looked up over DBus on the first call
+        and the result is reused afterwards.
+
+        :param refresh: Whether to rescan DBus for adapters instead
+        of using the cached list, defaults to False
+        :type refresh: bool, optional
         :return: A list of available adapter paths
         :rtype: list
         """
 
-        bus = dbus.SystemBus()
-        adapters = find_objects(bus, SERVICE_NAME, ADAPTER_INTERFACE)
-        bus.close()
+        if refresh or self._available_adapters is None:
+            self._available_adapters = find_objects(
+                _shared_bus(), SERVICE_NAME, ADAPTER_INTERFACE)
+
+        return list(self._available_adapters)
 
-        return adapters
+    def _get_usable_adapters(self, refresh=False):
+        """Gets the available adapters that aren't claimed by
+        a controller, in the order they were found.
+
+        :param refresh: Whether to rescan DBus for adapters,
+        defaults to False
+        :type refresh: bool, optional
+        :return: A list of usable adapter paths
+        :rtype: list
+        """
+
+        return [adapter for adapter in self.get_available_adapters(refresh)
+                if adapter not in self._adapters_in_use]
 
     def get_switch_addresses(self):
         """Gets the Bluetooth MAC addresses of all
@@ -707,9 +934,6 @@ class Nxbt():
                         A list of UUIDs
                     "errors":
                         A string with the crash error
-                    "direct_input":
-                        A dictionary that represents all inputs
-                        being directly input into the controller.
                 }
         }
 
@@ -719,6 +943,48 @@ class Nxbt():
 
         return self.manager_state
 
+    def get_controller_state(self, controller_index):
+        """Gets the state string of a controller. The state is read
+        from shared memory, without a round trip to the Manager.
+
+        :param controller_index: The index of the controller
+        :type controller_index: int
+        :return: The controller's state, Eg: "connected" or "crashed",
+        or None if the controller doesn't exist
+        :rtype: str or None
+        """
+
+        input_slot = self._controller_input_slots.get(controller_index)
+        if input_slot is None:
+            return None
+        return CONTROLLER_STATES[self._state_codes[input_slot].value]
+
+    def get_state_snapshot(self, controller_index=None):
+        """Gets a plain copy of the state dict, with each controller's
+        state copied out of its shared proxy. This is safe to serialize
+        and doesn't touch the manager when read. See the state property
+        for the dict's layout.
+
+        :param controller_index: The index of a single controller to
+        copy the state of, defaults to None (all controllers)
+        :type controller_index: int, optional
+        :raises ValueError: If the specified controller does not exist
+        :return: A copy of the state dict, or of the one controller's
+        state when an index is given
+        :rtype: dict
+        """
+
+        if controller_index is not None:
+            controller_state = self.manager_state.get(controller_index)
+            if controller_state is None:
+                raise ValueError("Specified controller does not exist")
+            return controller_state.copy()
+
+        return {
+            controller_index: controller_state.copy()
+            for controller_index, controller_state
+            in self.manager_state.copy().items()}
+
 
 class _ControllerManager():
     """Used as the manager for all controllers. Each controller is
@@ -730,17 +996,23 @@ class _ControllerManager():
     or macro clearing/stopping.
     """
 
-    def __init__(self, state, lock):
+    def __init__(self, state, lock, input_slots=None, state_semaphores=None,
+                 state_codes=None):
 
         self.state = state
         self.lock = lock
+        self.input_slots = input_slots
+        self.state_semaphores = state_semaphores
+        self.state_codes = state_codes
         self.controller_resources = Manager()
         self._controller_queues = {}
         self._children = {}
 
     def create_controller(self, index, controller_type, adapter_path,
                           colour_body=None, colour_buttons=None,
-                          reconnect_address=None):
+                          reconnect_address=None, input_slot=None,
+                          cpu_affinity=None, realtime_priority=None,
+                          disable_sniff=False):
         """Instantiates a given controller as a multiprocessing
         Process with a shared state dict and a task queue.
 
@@ -762,15 +1034,33 @@ class _ControllerManager():
         :param reconnect_address: The address of a Nintendo Switch
         to reconnect to, defaults to None
         :type reconnect_address: str, optional
+        :param input_slot: The shared memory slot carrying the
+        controller's direct input, defaults to None
+        :type input_slot: int, optional
+        :param cpu_affinity: The CPUs to pin the controller's input
+        loop to, defaults to None
+        :type cpu_affinity: set, optional
+        :param realtime_priority: The SCHED_FIFO priority of the
+        controller's input loop, defaults to None
+        :type realtime_priority: int, optional
+        :param disable_sniff: Keeps the link to the Switch out of
+        sniff mode, defaults to False
+        :type disable_sniff: bool, optional
         """
 
         controller_queue = Queue()
+        state_semaphore = None
+        state_code = None
+        if input_slot is not None:
+            if self.state_semaphores is not None:
+                state_semaphore = self.state_semaphores[input_slot]
+            if self.state_codes is not None:
+                state_code = self.state_codes[input_slot]
 
         controller_state = self.controller_resources.dict()
         controller_state["state"] = "initializing"
         controller_state["finished_macros"] = []
         controller_state["errors"] = False
-        controller_state["direct_input"] = json.loads(json.dumps(DIRECT_INPUT_PACKET))
         controller_state["colour_body"] = colour_body
         controller_state["colour_buttons"] = colour_buttons
         controller_state["type"] = str(controller_type)
@@ -794,7 +1084,14 @@ class _ControllerManager():
                                   state=controller_state,
                                   task_queue=controller_queue,
                                   colour_body=colour_body,
-                                  colour_buttons=colour_buttons)
+                                  colour_buttons=colour_buttons,
+                                  input_slots=self.input_slots,
+                                  input_slot=input_slot,
+                                  cpu_affinity=cpu_affinity,
+                                  realtime_priority=realtime_priority,
+                                  state_semaphore=state_semaphore,
+                                  state_code=state_code,
+                                  disable_sniff=disable_sniff)
         controller = Process(target=server.run, args=(reconnect_address,))
         controller.daemon = True
         self._children[index] = controller
@@ -822,8 +1119,15 @@ class _ControllerManager():
         })
 
     def remove_controller(self, index):
-        
-        self._children[index].terminate()
+
+        # The controller's state is only dropped once its process has
+        # exited, since the Nxbt object reuses its input slot after that
+        child = self._children.pop(index)
+        child.terminate()
+        child.join(CONTROLLER_STOP_TIMEOUT)
+        if child.is_alive():
+            os.kill(child.pid, signal.SIGKILL)
+            child.join()
         self.state.pop(index, None)
 
     def shutdown(self):
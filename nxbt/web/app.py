@@ -1,17 +1,34 @@
-import json
 import os
 from threading import RLock
+from functools import wraps
 import time
 from socket import gethostname
 
+# orjson is an optional, faster JSON codec for the input hot path
+# and outbound state frames
+try:
+    import orjson
+    from orjson import loads as _loads
+except ImportError:
+    orjson = None
+    from json import loads as _loads
+
 from .cert import generate_cert
 from ..nxbt import Nxbt, PRO_CONTROLLER
 from flask import Flask, render_template, request
 from flask_socketio import SocketIO, emit
+import gevent
 from gevent import pywsgi
 from geventwebsocket.handler import WebSocketHandler
 
 
+# Default locations for the generated SSL certificate and key
+_PKG_DIR = os.path.dirname(__file__)
+_DEFAULT_CERT = os.path.join(_PKG_DIR, "cert.pem")
+_DEFAULT_KEY = os.path.join(_PKG_DIR, "key.pem")
+_HOSTNAME = gethostname()
+
+
 app = Flask(__name__,
             static_url_path='',
             static_folder='static',)
@@ -38,6 +55,7 @@ def reset_nxbt():
         nxbt = None
         nxbt_init_failed = False
         nxbt_restart_count += 1
+        _invalidate_alive_check()
         
         # Log restart count but don't limit (MAX_NXBT_RESTARTS=None disables limit)
         print(f"NXBT restart #{nxbt_restart_count}")
@@ -70,26 +88,68 @@ def get_nxbt():
                 raise
         return nxbt
 
+
+# Errors raised when the multiprocessing manager has died
+_MANAGER_DEAD_EXCS = (
+    FileNotFoundError, EOFError, ConnectionRefusedError, BrokenPipeError, OSError)
+
+# Successful liveness probes are reused for _ALIVE_TTL seconds
+_ALIVE_TTL = 0.5
+_last_alive_check = 0.0
+_last_alive_result = False
+
+
+def _invalidate_alive_check():
+    """Forces the next check_nxbt_alive call to probe the manager"""
+    global _last_alive_check
+    _last_alive_check = 0.0
+
+
 def check_nxbt_alive():
     """Check if NXBT manager is still alive and responsive"""
-    global nxbt
+    global nxbt, _last_alive_check, _last_alive_result
     
     if nxbt is None:
         return False
+
+    now = time.monotonic()
+    if _last_alive_result and now - _last_alive_check < _ALIVE_TTL:
+        return True
     
     try:
         # Try to access the state - this will fail if manager is dead
         _ = nxbt.state.copy()
-        return True
-    except (FileNotFoundError, EOFError, ConnectionRefusedError, BrokenPipeError, OSError):
-        return False
+        _last_alive_result = True
     except Exception:
-        return False
+        _last_alive_result = False
+    _last_alive_check = now
+    return _last_alive_result
+
+
+def with_nxbt(on_dead=None):
+    """Decorates a SocketIO handler that needs a live NXBT manager.
+    The handler is passed the manager as its first argument. If the
+    manager is dead, either before or while the handler runs, on_dead
+    is called with the handler's arguments instead."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrap(*args, **kwargs):
+            if not check_nxbt_alive():
+                if on_dead:
+                    on_dead(*args, **kwargs)
+                return
+            try:
+                return fn(get_nxbt(), *args, **kwargs)
+            except _MANAGER_DEAD_EXCS:
+                _invalidate_alive_check()
+                if on_dead:
+                    on_dead(*args, **kwargs)
+        return wrap
+    return decorator
+
 
 # Configuring/retrieving secret key
-secrets_path = os.path.join(
-    os.path.dirname(__file__), "secrets.txt"
-)
+secrets_path = os.path.join(_PKG_DIR, "secrets.txt")
 if not os.path.isfile(secrets_path):
     secret_key = os.urandom(24).hex()
     with open(secrets_path, "w") as f:
@@ -100,15 +160,75 @@ else:
         secret_key = f.read()
 app.config['SECRET_KEY'] = secret_key
 
+
+class _OrjsonModule():
+    """A json module stand-in for SocketIO that encodes with orjson.
+    Controller indices are integer keys, so non-string keys are allowed.
+    """
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
+
 # Starting socket server with Flask app
 # Explicitly use gevent async mode to match the pywsgi server
 # max_http_buffer_size increased to handle rapid input events
+sio_options = {}
+if orjson is not None:
+    sio_options["json"] = _OrjsonModule
 sio = SocketIO(app, cookie=False, async_mode='gevent', 
                max_http_buffer_size=10*1024*1024,  # 10MB
                ping_timeout=60,
-               ping_interval=25)
+               ping_interval=25,
+               **sio_options)
+
+# The newest unsent input packet for each controller index, along with
+# the session that sent it. Older packets are superseded, as controllers
+# only use the most recent input.
+_input_queue = {}
+_input_drainer = None
+INPUT_DRAIN_INTERVAL = 1 / 120
+
+
+def _drain_input_queue():
+    """Ships queued input packets to NXBT in one batch each cycle"""
+    global _input_queue
+    while True:
+        gevent.sleep(INPUT_DRAIN_INTERVAL)
+        if not _input_queue or nxbt is None:
+            continue
+
+        batch, _input_queue = _input_queue, {}
+        try:
+            missing = nxbt.set_controller_input_batch(
+                {index: packet for index, (packet, _) in batch.items()})
+        except _MANAGER_DEAD_EXCS:
+            # Manager died - silently drop input
+            _invalidate_alive_check()
+            continue
+        except Exception as e:
+            print(f"Input error: {e}")
+            continue
+
+        for index in missing:
+            sio.emit('controller_error',
+                     {'index': index, 'error': 'Specified controller does not exist'},
+                     to=batch[index][1])
+
+
+def _ensure_input_drainer():
+    global _input_drainer
+    if _input_drainer is None or _input_drainer.dead:
+        _input_drainer = gevent.spawn(_drain_input_queue)
 
-user_info_lock = RLock()
+
+# Per-session state, keyed by SocketIO session ID. All handlers run
+# on the gevent hub's thread, so single dict operations need no lock.
 USER_INFO = {}
 
 
@@ -127,15 +247,14 @@ def health():
     
     try:
         nx = get_nxbt()
-        return {'status': 'ok', 'adapters': len(nx.get_available_adapters())}, 200
+        return {'status': 'ok', 'adapters': len(nx.get_available_adapters(refresh=True))}, 200
     except Exception as e:
         return {'status': 'error', 'message': str(e)}, 500
 
 
 @sio.on('connect')
 def on_connect():
-    with user_info_lock:
-        USER_INFO[request.sid] = {}
+    USER_INFO[request.sid] = {}
 
 
 @sio.on('state')
@@ -154,13 +273,10 @@ def on_state():
                 return
         
         nx = get_nxbt()
-        state_proxy = nx.state.copy()
-        state = {}
-        for controller in state_proxy.keys():
-            state[controller] = state_proxy[controller].copy()
-        emit('state', state)
-    except (FileNotFoundError, EOFError, ConnectionRefusedError, BrokenPipeError, OSError) as e:
+        emit('state', nx.get_state_snapshot())
+    except _MANAGER_DEAD_EXCS as e:
         # Multiprocessing manager has died - attempt recovery
+        _invalidate_alive_check()
         print(f"NXBT manager connection lost: {e}")
         try:
             reset_nxbt()
@@ -176,61 +292,59 @@ def on_state():
 @sio.on('disconnect')
 def on_disconnect():
     print("Disconnected")
-    with user_info_lock:
-        try:
-            if not check_nxbt_alive():
-                print("NXBT manager not alive during disconnect - skipping controller cleanup")
-                USER_INFO.pop(request.sid, None)
-                return
-            
-            nx = get_nxbt()
-            index = USER_INFO[request.sid]["controller_index"]
-            nx.remove_controller(index)
-        except (KeyError, ValueError):
-            pass
-        except Exception as e:
-            print(f"Error during disconnect cleanup: {e}")
-        finally:
-            # Clean up user info regardless
-            USER_INFO.pop(request.sid, None)
-
-
-@sio.on('shutdown')
-def on_shutdown(index):
+    # Clean up user info regardless of whether the controller is removed
+    info = USER_INFO.pop(request.sid, {})
     try:
         if not check_nxbt_alive():
-            emit('error', 'NXBT manager connection lost')
+            print("NXBT manager not alive during disconnect - skipping controller cleanup")
             return
         
         nx = get_nxbt()
+        index = info["controller_index"]
+        nx.remove_controller(index)
+    except (KeyError, ValueError):
+        pass
+    except Exception as e:
+        print(f"Error during disconnect cleanup: {e}")
+
+
+def _emit_manager_dead_shutdown(index):
+    emit('error', 'NXBT manager connection lost')
+
+
+@sio.on('shutdown')
+@with_nxbt(on_dead=_emit_manager_dead_shutdown)
+def on_shutdown(nx, index):
+    try:
         nx.remove_controller(index)
         # Clean up user info if this was their controller
-        with user_info_lock:
-            if request.sid in USER_INFO and USER_INFO[request.sid].get("controller_index") == index:
-                USER_INFO[request.sid].pop("controller_index", None)
+        info = USER_INFO.get(request.sid, {})
+        if info.get("controller_index") == index:
+            info.pop("controller_index", None)
     except ValueError as e:
         emit('error', f'Shutdown error: {str(e)}')
+    except _MANAGER_DEAD_EXCS:
+        raise
     except Exception as e:
         emit('error', f'Unexpected shutdown error: {str(e)}')
 
 
+def _emit_manager_dead_health(index):
+    emit('controller_health', {'index': index, 'state': 'manager_dead', 'exists': False})
+
+
 @sio.on('check_controller_health')
-def check_controller_health(index):
+@with_nxbt(on_dead=_emit_manager_dead_health)
+def check_controller_health(nx, index):
     """Check if a controller is healthy and return its state"""
     try:
-        if not check_nxbt_alive():
-            emit('controller_health', {'index': index, 'state': 'manager_dead', 'exists': False})
-            return
-        
-        nx = get_nxbt()
-        if index in nx.state:
-            state = nx.state[index].get('state')
+        state = nx.get_controller_state(index)
+        if state is not None:
             emit('controller_health', {'index': index, 'state': state, 'exists': True})
         else:
             emit('controller_health', {'index': index, 'state': None, 'exists': False})
-    except (FileNotFoundError, EOFError, ConnectionRefusedError, BrokenPipeError, OSError):
-        # Manager died - controller doesn't exist
-        emit('controller_health', {'index': index, 'state': 'manager_dead', 'exists': False})
+    except _MANAGER_DEAD_EXCS:
+        raise
     except Exception as e:
         emit('error', f'Health check error: {str(e)}')
 
@@ -247,19 +361,17 @@ def on_create_controller():
         nx = get_nxbt()
         
         # Clean up any existing crashed controller for this session
-        with user_info_lock:
-            if request.sid in USER_INFO and "controller_index" in USER_INFO[request.sid]:
-                old_index = USER_INFO[request.sid]["controller_index"]
-                try:
-                    nx.remove_controller(old_index)
-                except (ValueError, KeyError):
-                    pass
+        old_index = USER_INFO.get(request.sid, {}).pop("controller_index", None)
+        if old_index is not None:
+            try:
+                nx.remove_controller(old_index)
+            except (ValueError, KeyError):
+                pass
         
         reconnect_addresses = nx.get_switch_addresses()
         index = nx.create_controller(PRO_CONTROLLER, reconnect_address=reconnect_addresses)
 
-        with user_info_lock:
-            USER_INFO[request.sid]["controller_index"] = index
+        USER_INFO.setdefault(request.sid, {})["controller_index"] = index
 
         emit('create_pro_controller', index)
     except Exception as e:
@@ -279,13 +391,12 @@ def on_reconnect_controller():
         nx = get_nxbt()
         
         # Remove the old controller
-        with user_info_lock:
-            if request.sid in USER_INFO and "controller_index" in USER_INFO[request.sid]:
-                old_index = USER_INFO[request.sid]["controller_index"]
-                try:
-                    nx.remove_controller(old_index)
-                except (ValueError, KeyError):
-                    pass
+        old_index = USER_INFO.get(request.sid, {}).pop("controller_index", None)
+        if old_index is not None:
+            try:
+                nx.remove_controller(old_index)
+            except (ValueError, KeyError):
+                pass
         
         # Create new controller with reconnect address (seamless reconnection)
         reconnect_addresses = nx.get_switch_addresses()
@@ -295,67 +406,59 @@ def on_reconnect_controller():
             
         index = nx.create_controller(PRO_CONTROLLER, reconnect_address=reconnect_addresses)
 
-        with user_info_lock:
-            USER_INFO[request.sid]["controller_index"] = index
+        USER_INFO.setdefault(request.sid, {})["controller_index"] = index
 
         emit('reconnect_controller', index)
     except Exception as e:
         emit('error', str(e))
 
 
+# Input is silently ignored while the manager is dead
 @sio.on('input')
-def handle_input(message):
+@with_nxbt()
+def handle_input(nx, message):
     # print("Webapp Input", time.perf_counter())
     try:
-        if not check_nxbt_alive():
-            # Silently ignore input if manager is dead
-            return
-        
-        nx = get_nxbt()
-        message = json.loads(message)
+        message = _loads(message)
         index = message[0]
         input_packet = message[1]
         
-        # Check if controller exists and is not crashed
-        if index in nx.state:
-            controller_state = nx.state[index].get('state')
-            if controller_state == 'crashed':
-                emit('controller_crashed', index)
-                return
+        # Check if controller is crashed
+        if nx.get_controller_state(index) == 'crashed':
+            emit('controller_crashed', index)
+            return
         
-        nx.set_controller_input(index, input_packet)
-    except (FileNotFoundError, EOFError, ConnectionRefusedError, BrokenPipeError, OSError):
-        # Manager died - silently ignore input
-        pass
+        # Queue the packet rather than sending it to the manager per message
+        _input_queue[index] = (input_packet, request.sid)
+        _ensure_input_drainer()
+    except _MANAGER_DEAD_EXCS:
+        raise
     except ValueError as e:
         emit('controller_error', {'index': message[0] if message else None, 'error': str(e)})
     except Exception as e:
         emit('error', f'Input error: {str(e)}')
 
 
+def _emit_manager_dead_macro(message):
+    emit('controller_error', {'index': None, 'error': 'NXBT manager connection lost'})
+
+
 @sio.on('macro')
-def handle_macro(message):
+@with_nxbt(on_dead=_emit_manager_dead_macro)
+def handle_macro(nx, message):
     try:
-        if not check_nxbt_alive():
-            emit('controller_error', {'index': None, 'error': 'NXBT manager connection lost'})
-            return
-        
-        nx = get_nxbt()
-        message = json.loads(message)
+        message = _loads(message)
         index = message[0]
         macro = message[1]
         
-        # Check if controller exists and is not crashed
-        if index in nx.state:
-            controller_state = nx.state[index].get('state')
-            if controller_state == 'crashed':
-                emit('controller_crashed', index)
-                return
+        # Check if controller is crashed
+        if nx.get_controller_state(index) == 'crashed':
+            emit('controller_crashed', index)
+            return
         
         nx.macro(index, macro)
-    except (FileNotFoundError, EOFError, ConnectionRefusedError, BrokenPipeError, OSError):
-        # Manager died - emit error
-        emit('controller_error', {'index': message[0] if message else None, 'error': 'NXBT manager connection lost'})
+    except _MANAGER_DEAD_EXCS:
+        raise
     except ValueError as e:
         emit('controller_error', {'index': message[0] if message else None, 'error': str(e)})
     except Exception as e:
@@ -378,20 +481,13 @@ def start_web_app(ip='0.0.0.0', port=8000, usessl=False, cert_path=None):
     if usessl:
         if cert_path is None:
             # Store certs in the package directory
-            cert_path = os.path.join(
-                os.path.dirname(__file__), "cert.pem"
-            )
-            key_path = os.path.join(
-                os.path.dirname(__file__), "key.pem"
-            )
+            cert_path = _DEFAULT_CERT
+            key_path = _DEFAULT_KEY
         else:
             # If specified, store certs at the user's preferred location
-            cert_path = os.path.join(
-                cert_path, "cert.pem"
-            )
-            key_path = os.path.join(
-                cert_path, "key.pem"
-            )
+            cert_dir = cert_path
+            cert_path = os.path.join(cert_dir, "cert.pem")
+            key_path = os.path.join(cert_dir, "key.pem")
         if not os.path.isfile(cert_path) or not os.path.isfile(key_path):
             print(
                 "\n"
@@ -413,7 +509,7 @@ def start_web_app(ip='0.0.0.0', port=8000, usessl=False, cert_path=None):
                 "\n"
             )
             print("Generating certificates...")
-            cert, key = generate_cert(gethostname())
+            cert, key = generate_cert(_HOSTNAME)
             with open(cert_path, "wb") as f:
                 f.write(cert)
             with open(key_path, "wb") as f:
@@ -4,9 +4,12 @@ Script that runs a macro loop: DPAD_RIGHT, 3x A presses, DPAD_LEFT
 Repeats 20 times.
 """
 
+import textwrap
+
 import nxbt
 
-MACRO = """
+# Dedented and stripped once at load, so the parser gets clean lines
+MACRO = textwrap.dedent("""
 LOOP 20
     DPAD_RIGHT 3s
     A 0.2s
@@ -16,7 +19,15 @@ LOOP 20
     A 0.2s
     0.5s
     DPAD_LEFT 3s
-"""
+""").strip()
+
+# Optional scheduling for the controller's input loop, which smooths
+# out the timing of input reports. Both are off by default. Pinning
+# takes a core isolated from the scheduler, Eg: {3} when booted with
+# "isolcpus=3 nohz_full=3", and the priority is a SCHED_FIFO level
+# (needs root), Eg: 80.
+CONTROLLER_CPUS = None
+CONTROLLER_PRIORITY = None
 
 def main():
     # Initialize NXBT
@@ -33,7 +44,9 @@ def main():
     # Create a Pro Controller
     controller_index = nx.create_controller(
         nxbt.PRO_CONTROLLER,
-        adapter_path=adapters[0]
+        cpu_affinity=CONTROLLER_CPUS,
+        realtime_priority=CONTROLLER_PRIORITY,
+        disable_sniff=True
     )
     
     print(f"Controller created with index: {controller_index}")
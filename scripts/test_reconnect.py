@@ -11,6 +11,7 @@ Usage:
     sudo python3 scripts/test_reconnect.py
 
 Requirements:
+- NXBT must be installed, Eg: "sudo pip3 install -e ." from the repository root
 - Must have previously connected to a Switch using NXBT
 - Switch should be on the Home Screen (not Change Grip/Order menu)
 """
@@ -18,21 +19,29 @@ Requirements:
 import sys
 import time
 import os
+import signal
+import traceback
 
-# Add parent directory to path for imports
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Reconnection attempts made with the same Nxbt instance before giving up
+RECONNECT_ATTEMPTS = 3
+# Seconds each attempt waits for the Switch to connect
+RECONNECT_TIMEOUT = 30
 
 def main():
     print("=" * 60)
     print("NXBT Reconnection Test")
     print("=" * 60)
     
+    # Exit through SystemExit on SIGTERM so that NXBT's exit handlers
+    # still remove the controller and restore the BlueZ plugins
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
     # Check for root privileges
     if os.geteuid() != 0:
         print("ERROR: This script must be run as root (sudo)")
         sys.exit(1)
     
-    # Import after path setup
+    # Imported after the root check, since NXBT's setup needs root
     from nxbt.bluez import load_connection_state, get_stored_switch_addresses
     import nxbt
     
@@ -80,22 +89,22 @@ def main():
     print()
     
     try:
-        controller_index = nx.create_controller(
-            nxbt.PRO_CONTROLLER,
-            reconnect_address=all_addresses
-        )
-        
-        print(f"   Controller created with index: {controller_index}")
-        
-        # Wait for connection
-        print("\n5. Waiting for connection...")
-        timeout = 30
-        start_time = time.time()
-        
-        while time.time() - start_time < timeout:
-            state = nx.state[controller_index]
-            current_state = state.get("state", "unknown")
-            
+        for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+            controller_index = nx.create_controller(
+                nxbt.PRO_CONTROLLER,
+                reconnect_address=all_addresses,
+                disable_sniff=True
+            )
+
+            print(f"   Controller created with index: {controller_index}")
+
+            # Wait for connection
+            print(f"\n5. Waiting for connection (attempt {attempt}/{RECONNECT_ATTEMPTS})...")
+            current_state = nx.wait_for_state(
+                controller_index, "connected", timeout=RECONNECT_TIMEOUT)
+            # One plain copy, rather than a proxy round trip per field
+            state = nx.get_state_snapshot(controller_index)
+
             if current_state == "connected":
                 print(f"   SUCCESS! Connected to Switch!")
                 print(f"   Last connection: {state.get('last_connection', 'N/A')}")
@@ -103,13 +112,13 @@ def main():
             elif current_state == "crashed":
                 print(f"   ERROR: Controller crashed!")
                 print(f"   Error: {state.get('errors', 'Unknown error')}")
-                sys.exit(1)
             else:
-                print(f"   State: {current_state}...", end='\r')
-            
-            time.sleep(0.5)
+                print(f"   TIMEOUT: Connection took too long (state: {current_state})")
+
+            # Free the failed controller and its adapter, keeping the
+            # same Nxbt instance (and its processes) for the next attempt
+            nx.reset_state()
         else:
-            print(f"\n   TIMEOUT: Connection took too long")
             sys.exit(1)
         
         # Test input
@@ -121,7 +130,7 @@ def main():
         
         # Cleanup
         print("\n7. Cleaning up...")
-        nx.remove_controller(controller_index)
+        nx.reset_state()
         print("   Controller removed.")
         
         print("\n" + "=" * 60)
@@ -130,7 +139,6 @@ def main():
         
     except Exception as e:
         print(f"\n   ERROR: {e}")
-        import traceback
         traceback.print_exc()
         sys.exit(1)
 
@@ -3,9 +3,14 @@
 Script that farms XP in Pokemon Legends ZA at Resturant Le Nah
 """
 
+import sys
+import textwrap
+import time
+
 import nxbt
 
-MACRO = """
+# Dedented and stripped once at load, so the parser gets clean lines
+MACRO = textwrap.dedent("""
 LOOP 10000000
     ZL 0.3s
     A 0.1s
@@ -14,7 +19,21 @@ LOOP 10000000
     ZL 0.3s
     B 0.1s
     0.3s
-"""
+""").strip()
+
+# Seconds between macro progress updates
+PROGRESS_INTERVAL = 1
+# The progress line is only drawn on a terminal; piped or logged runs
+# would just accumulate carriage-return lines
+SHOW_PROGRESS = sys.stdout.isatty()
+
+# Optional scheduling for the controller's input loop, which smooths
+# out the timing of input reports. Both are off by default. Pinning
+# takes a core isolated from the scheduler, Eg: {3} when booted with
+# "isolcpus=3 nohz_full=3", and the priority is a SCHED_FIFO level
+# (needs root), Eg: 80.
+CONTROLLER_CPUS = None
+CONTROLLER_PRIORITY = None
 
 def main():
     # Initialize NXBT
@@ -31,7 +50,9 @@ def main():
     # Create a Pro Controller
     controller_index = nx.create_controller(
         nxbt.PRO_CONTROLLER,
-        adapter_path=adapters[0]
+        cpu_affinity=CONTROLLER_CPUS,
+        realtime_priority=CONTROLLER_PRIORITY,
+        disable_sniff=True
     )
     
     print(f"Controller created with index: {controller_index}")
@@ -45,10 +66,25 @@ def main():
     
     print("Running macro...")
     
-    # Run the macro
-    nx.macro(controller_index, MACRO, block=True)
+    # The whole loop runs inside the controller process. Rather than
+    # blocking (which polls the controller state 120 times a second),
+    # check on its progress once every PROGRESS_INTERVAL.
+    macro_id = nx.macro(controller_index, MACRO, block=False)
+    while True:
+        state = nx.state[controller_index]
+        if macro_id in state["finished_macros"]:
+            break
+        if state["state"] == "crashed":
+            print(f"\nController crashed: {state['errors']}")
+            return
+
+        if SHOW_PROGRESS:
+            progress = state["macro_progress"]
+            print(f"Line {progress['current_line']}/{progress['total_lines']} "
+                  f"({progress['progress']}%)", end='\r', flush=True)
+        time.sleep(PROGRESS_INTERVAL)
     
-    print("Macro complete!")
+    print("\nMacro complete!")
 
 if __name__ == "__main__":
     main()
@@ -5,6 +5,8 @@ This script creates a Pro Controller and waits for the Switch to connect.
 No manual bluetoothctl intervention should be required.
 """
 
+import signal
+
 import nxbt
 
 # Create an NXBT instance
@@ -16,7 +18,7 @@ print("Go to your Switch's 'Change Grip/Order' menu to connect.")
 print("The connection should happen automatically without requiring bluetoothctl!")
 
 # Create a Pro Controller
-controller_index = nx.create_controller(nxbt.PRO_CONTROLLER)
+controller_index = nx.create_controller(nxbt.PRO_CONTROLLER, disable_sniff=True)
 
 print(f"Controller created with index: {controller_index}")
 print("Waiting for Switch to connect...")
@@ -33,11 +35,10 @@ nx.press_buttons(controller_index, [nxbt.Buttons.A])
 print("Test complete! The controller should have pressed the A button.")
 print("Press Ctrl+C to exit.")
 
-# Keep the script running
+# Keep the script running until interrupted
 try:
-    import time
-    while True:
-        time.sleep(1)
+    signal.pause()
 except KeyboardInterrupt:
     print("\nExiting...")
-    nx.remove_controller(controller_index)
+    # Also frees the controller if it crashed while idle
+    nx.reset_state()
@@ -0,0 +1,55 @@
+import struct
+import types
+
+import pytest
+
+pytest.importorskip("dbus")
+pytest.importorskip("gi")
+
+from nxbt import bluez  # noqa: E402
+
+
+class _FakeSocket():
+
+    def __init__(self, *args):
+        self.bound = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def bind(self, address):
+        self.bound = address
+
+    def fileno(self):
+        return -1
+
+
+def test_hci_connection_handle_layout(monkeypatch):
+    requests = []
+
+    def fake_ioctl(fd, request_code, request):
+        assert request_code == bluez.HCIGETCONNINFO
+        requests.append(bytes(request))
+        # The kernel writes struct hci_conn_info after the padded
+        # request, starting with the handle
+        struct.pack_into("<H", request, bluez.HCI_CONN_INFO_OFFSET, 0x0abc)
+        return 0
+
+    # Not every Python build has the Bluetooth socket constants
+    fake_socket_module = types.SimpleNamespace(
+        socket=_FakeSocket, AF_BLUETOOTH=31, SOCK_RAW=3, BTPROTO_HCI=1)
+    monkeypatch.setattr(bluez, "socket", fake_socket_module)
+    monkeypatch.setattr(bluez.fcntl, "ioctl", fake_ioctl)
+
+    handle = bluez._hci_connection_handle(0, "01:23:45:67:89:AB")
+
+    assert handle == 0x0abc
+    request, = requests
+    assert len(request) == 8 + 16
+    # bdaddr is little-endian, followed by the link type and padding
+    assert request[:6] == bytes([0xAB, 0x89, 0x67, 0x45, 0x23, 0x01])
+    assert request[6] == bluez.ACL_LINK
+    assert request[7] == 0